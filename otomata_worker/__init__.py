@@ -1,39 +1,47 @@
 """Otomata Worker - Distributed task execution with Claude Agent SDK."""
 
+from importlib import import_module
+
 __version__ = "0.1.0"
 
-from .models import (
-    Task, TaskStatus,
-    Chat, Message, MessageRole, TaskEvent,
-    Identity, RateLimit, Secret, SecretScope,
-)
-from .database import get_session, init_db
-from .secrets import SecretsService, secrets_service
-from .identities import IdentityManager
-from .rate_limiter import DBRateLimiter
-from .task_manager import TaskManager
-from .chat_manager import ChatManager
-from .events import TaskEventStore, event_store
-
-__all__ = [
-    "Task",
-    "TaskStatus",
-    "Chat",
-    "Message",
-    "MessageRole",
-    "TaskEvent",
-    "Identity",
-    "RateLimit",
-    "Secret",
-    "SecretScope",
-    "get_session",
-    "init_db",
-    "SecretsService",
-    "secrets_service",
-    "IdentityManager",
-    "DBRateLimiter",
-    "TaskManager",
-    "ChatManager",
-    "TaskEventStore",
-    "event_store",
-]
+# Public names are imported on first access (PEP 562), so that importing the
+# package (e.g. for `otomata-worker --help`) does not load SQLAlchemy & co.
+_LAZY = {
+    "Task": "models",
+    "TaskStatus": "models",
+    "Chat": "models",
+    "Message": "models",
+    "MessageRole": "models",
+    "TaskEvent": "models",
+    "Identity": "models",
+    "RateLimit": "models",
+    "Secret": "models",
+    "SecretScope": "models",
+    "get_session": "database",
+    "init_db": "database",
+    "SecretsService": "secrets",
+    "secrets_service": "secrets",
+    "IdentityManager": "identities",
+    "DBRateLimiter": "rate_limiter",
+    "TaskManager": "task_manager",
+    "TaskOut": "task_manager",
+    "TaskView": "task_manager",
+    "ChatManager": "chat_manager",
+    "TaskEventStore": "events",
+    "event_store": "events",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,12 +1,140 @@
 """Chat management - create chats, add messages, get history."""
 
+from contextlib import nullcontext
 from datetime import datetime, date, timedelta
 from typing import Optional
 
-from sqlalchemy import func
+from sqlalchemy import DateTime, and_, bindparam, func, insert, lambda_stmt, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, raiseload, selectinload
 
-from .models import Chat, Message, MessageRole, Task, TaskEvent
+from .models import Chat, Message, MessageRole
 from .database import get_session
+from .events import summarize_tool_use
+
+
+def _metadata_forms(value) -> list:
+    """JSON values of a metadata filter value that have the same str().
+
+    Query params are always strings, so "42" also matches a stored 42
+    (and "True" a stored true), as the former str() comparison did.
+    """
+    forms = [value]
+    if isinstance(value, str):
+        if value in ('True', 'False'):
+            forms.append(value == 'True')
+        for parse in (int, float):
+            try:
+                number = parse(value)
+            except ValueError:
+                continue
+            if str(number) == value:
+                forms.append(number)
+                break
+    return forms
+
+
+# Hot read statements, built once: lambda_stmt caches the compiled SQL so
+# repeated calls skip statement construction and cache-key generation.
+_rendered_history_stmt = lambda_stmt(lambda: select(
+    Chat.rendered_history
+).where(Chat.id == bindparam('chat_id')))
+
+_messages_stmt = lambda_stmt(lambda: select(
+    Message.id,
+    Message.role,
+    Message.content,
+    Message.sequence,
+    Message.tokens_input,
+    Message.tokens_output,
+    Message.created_at,
+).where(
+    Message.chat_id == bindparam('chat_id')
+).order_by(Message.sequence))
+
+_history_stmt = lambda_stmt(lambda: select(
+    Message.role, Message.content
+).where(
+    Message.chat_id == bindparam('chat_id')
+).order_by(Message.sequence))
+
+
+# Messages with, on each user message, the text/tool_use events of the task
+# that answered it (k-th user message <-> k-th task of the chat), in one
+# round-trip. tool_use payloads are only sent when display_summary is missing.
+_messages_with_events_stmt = text("""
+    WITH msgs AS (
+        SELECT id, role, content, sequence, tokens_input, tokens_output, created_at,
+               CASE WHEN role = 'user'
+                    THEN count(*) FILTER (WHERE role = 'user') OVER (ORDER BY sequence)
+               END AS user_rn
+        FROM messages
+        WHERE chat_id = :chat_id
+    ),
+    chat_tasks AS (
+        SELECT id, row_number() OVER (ORDER BY created_at, id) AS rn
+        FROM tasks
+        WHERE chat_id = :chat_id
+    )
+    SELECT m.id, m.role, m.content, m.sequence, m.tokens_input, m.tokens_output,
+           m.created_at, ev.events
+    FROM msgs m
+    LEFT JOIN chat_tasks t ON t.rn = m.user_rn
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(jsonb_build_object(
+                   'type', e.event_type,
+                   'summary', e.display_summary,
+                   'data', CASE WHEN e.event_type = 'text' OR e.display_summary IS NULL
+                                THEN e.event_data END,
+                   -- fixed-width so datetime.fromisoformat parses it on 3.10
+                   'created_at', to_char(e.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+               ) ORDER BY e.created_at, e.sequence) AS events
+        FROM task_events e
+        WHERE e.task_id = t.id AND e.event_type IN ('text', 'tool_use')
+    ) ev ON true
+    ORDER BY m.sequence
+""").columns(role=Message.__table__.c.role.type, created_at=DateTime)
+
+
+def _message_row(message_id, role, content, sequence, tokens_input, tokens_output, created_at) -> dict:
+    """A message row as returned by list_messages (role value, ISO timestamp)."""
+    return {
+        'id': message_id,
+        'role': role.value,
+        'content': content,
+        'sequence': sequence,
+        'tokens_input': tokens_input,
+        'tokens_output': tokens_output,
+        'created_at': created_at.isoformat() if created_at else None,
+    }
+
+
+def render_messages(messages: list[dict]) -> str:
+    """Render messages as agent context: "User: ...\n\nAssistant: ...\n\n"."""
+    parts = []
+    for msg in messages:
+        parts.append("User: " if msg["role"] == "user" else "Assistant: ")
+        parts.append(msg["content"])
+        parts.append("\n\n")
+    return "".join(parts)
+
+
+def _event_to_message(event: dict) -> dict:
+    """Turn a text/tool_use event (as aggregated in SQL) into a message dict."""
+    data = event['data'] or {}
+    if event['type'] == 'tool_use':
+        # Precomputed at write time; older rows lack it
+        summary = event['summary']
+        return {
+            'role': 'tool_use',
+            'content': summary if summary is not None else summarize_tool_use(data),
+            'created_at': datetime.fromisoformat(event['created_at']).isoformat(),
+        }
+    return {
+        'role': 'assistant',
+        'content': data.get('content', ''),
+        'created_at': datetime.fromisoformat(event['created_at']).isoformat(),
+    }
 
 
 class ChatManager:
@@ -34,43 +162,58 @@ class ChatManager:
                 allowed_tools=allowed_tools or [],
                 max_turns=max_turns,
                 metadata_=metadata,
+                rendered_history='',
             )
             session.add(chat)
             session.flush()
             return chat.id
 
-    def list_chats(self, tenant: str = None, metadata_filter: dict = None) -> list[dict]:
-        """List chats, optionally filtered by tenant and metadata keys."""
+    def list_chats(
+        self,
+        tenant: str = None,
+        metadata_filter: dict = None,
+        limit: Optional[int] = None
+    ) -> list[dict]:
+        """List chats, optionally filtered by tenant and metadata keys.
+
+        The metadata filter is a JSONB containment check (`@>`), served by
+        the GIN index on chats.metadata; string values also match the
+        number/boolean they spell. Message counts come from the chat
+        row, not from the messages table.
+        """
         with get_session() as session:
-            q = session.query(Chat).order_by(Chat.created_at.desc())
+            q = select(
+                Chat.id,
+                Chat.tenant,
+                Chat.metadata_.label('metadata'),
+                Chat.message_count,
+                Chat.last_message_at,
+                Chat.created_at,
+                Chat.updated_at,
+            ).order_by(Chat.created_at.desc())
             if tenant:
-                q = q.filter(Chat.tenant == tenant)
-            chats = q.all()
-
-            # Filter by metadata keys (in-memory, good enough for reasonable volumes)
+                q = q.where(Chat.tenant == tenant)
             if metadata_filter:
-                filtered = []
-                for c in chats:
-                    meta = c.metadata_ or {}
-                    if all(str(meta.get(k)) == str(v) for k, v in metadata_filter.items()):
-                        filtered.append(c)
-                chats = filtered
-
+                q = q.where(and_(*(
+                    or_(*(Chat.metadata_.contains({key: form}) for form in _metadata_forms(value)))
+                    for key, value in metadata_filter.items()
+                )))
+            if limit:
+                q = q.limit(limit)
             return [
                 {
-                    'id': c.id,
-                    'tenant': c.tenant,
-                    'metadata': c.metadata_,
-                    'created_at': c.created_at.isoformat() if c.created_at else None,
-                    'updated_at': c.updated_at.isoformat() if c.updated_at else None,
+                    **chat,
+                    'last_message_at': chat['last_message_at'].isoformat() if chat['last_message_at'] else None,
+                    'created_at': chat['created_at'].isoformat() if chat['created_at'] else None,
+                    'updated_at': chat['updated_at'].isoformat() if chat['updated_at'] else None,
                 }
-                for c in chats
+                for chat in session.execute(q).mappings()
             ]
 
-    def get_chat(self, chat_id: int) -> Optional[dict]:
+    def get_chat(self, chat_id: int, session: Optional[Session] = None) -> Optional[dict]:
         """Get chat by ID (without messages)."""
-        with get_session() as session:
-            chat = session.query(Chat).get(chat_id)
+        with get_session(session) as session:
+            chat = session.get(Chat, chat_id)
             if not chat:
                 return None
             return {
@@ -88,7 +231,11 @@ class ChatManager:
     def get_chat_with_messages(self, chat_id: int) -> Optional[dict]:
         """Get chat with all messages."""
         with get_session() as session:
-            chat = session.query(Chat).get(chat_id)
+            # Messages come in one IN-query; any other lazy load raises
+            chat = session.get(Chat, chat_id, options=[
+                selectinload(Chat.messages),
+                raiseload('*'),
+            ])
             if not chat:
                 return None
             return {
@@ -115,96 +262,39 @@ class ChatManager:
                 ],
             }
 
-    def list_messages(self, chat_id: int, include_tools: bool = False) -> list[dict]:
+    def list_messages(
+        self,
+        chat_id: int,
+        include_tools: bool = False,
+        session: Optional[Session] = None,
+    ) -> list[dict]:
         """List messages for a chat, optionally with tool_use events interleaved."""
-        with get_session() as session:
-            messages = session.query(Message).filter(
-                Message.chat_id == chat_id
-            ).order_by(Message.sequence).all()
-
-            result = [
-                {
-                    'id': m.id,
-                    'role': m.role.value,
-                    'content': m.content,
-                    'sequence': m.sequence,
-                    'tokens_input': m.tokens_input,
-                    'tokens_output': m.tokens_output,
-                    'created_at': m.created_at.isoformat() if m.created_at else None,
-                }
-                for m in messages
-            ]
-
+        with get_session(session) as session:
             if not include_tools:
-                return result
-
-            # Fetch text + tool_use events per task, use them instead of
-            # the single concatenated assistant Message record.
-            from collections import defaultdict
-
-            task_events = session.query(TaskEvent).join(Task).filter(
-                Task.chat_id == chat_id,
-                TaskEvent.event_type.in_(['text', 'tool_use']),
-            ).order_by(TaskEvent.created_at).all()
-
-            # Build per-task event lists (chronological)
-            events_by_task = defaultdict(list)
-            for te in task_events:
-                data = te.event_data or {}
-                if te.event_type == 'tool_use':
-                    detail = data.get('tool', 'tool')
-                    inp = data.get('input', {})
-                    if detail == 'Bash' and isinstance(inp, dict) and inp.get('command'):
-                        cmd = inp['command']
-                        detail = f"Bash: {cmd[:80]}..." if len(cmd) > 80 else f"Bash: {cmd}"
-                    elif detail in ('Read', 'Write', 'Edit') and isinstance(inp, dict) and inp.get('file_path'):
-                        detail = f"{detail}: {inp['file_path']}"
-                    elif detail in ('Glob', 'Grep') and isinstance(inp, dict) and inp.get('pattern'):
-                        detail = f"{detail}: {inp['pattern']}"
-                    events_by_task[te.task_id].append({
-                        'role': 'tool_use',
-                        'content': detail,
-                        'created_at': te.created_at.isoformat() if te.created_at else None,
-                    })
-                else:  # text
-                    events_by_task[te.task_id].append({
-                        'role': 'assistant',
-                        'content': data.get('content', ''),
-                        'created_at': te.created_at.isoformat() if te.created_at else None,
-                    })
-
-            # Match tasks to user messages by creation order
-            tasks = session.query(Task).filter(
-                Task.chat_id == chat_id
-            ).order_by(Task.created_at).all()
-
-            user_msg_indices = [i for i, m in enumerate(result) if m['role'] == 'user']
-
-            # Replace concatenated assistant messages with per-turn events
-            # Build: user_msg → text1 → tool1 → tool2 → text2 → ...
-            task_for_user = {}
-            for task_idx, task in enumerate(tasks):
-                if task_idx < len(user_msg_indices):
-                    task_for_user[user_msg_indices[task_idx]] = task.id
-
-            # Find assistant messages to skip (replaced by per-turn text events)
-            skip_indices = set()
-            for user_idx, task_id in task_for_user.items():
-                if events_by_task.get(task_id):
-                    for j in range(user_idx + 1, len(result)):
-                        if result[j]['role'] == 'assistant':
-                            skip_indices.add(j)
-                            break
-
-            final = []
-            for i, msg in enumerate(result):
-                if i in skip_indices:
-                    continue
-                final.append(msg)
-                if i in task_for_user:
-                    final.extend(events_by_task.get(task_for_user[i], []))
-
-            return final
+                return [
+                    _message_row(*row)
+                    for row in session.execute(_messages_stmt, {'chat_id': chat_id})
+                ]
+
+            rows = session.execute(_messages_with_events_stmt, {'chat_id': chat_id}).all()
+
+        # Replace concatenated assistant messages with per-turn events
+        # Build: user_msg → text1 → tool1 → tool2 → text2 → ...
+        # The first assistant message after a user message that has events
+        # is the concatenated version of those events: skip it.
+        final = []
+        skip_next_assistant = False
+        for *columns, events in rows:
+            msg = _message_row(*columns)
+            if msg['role'] == MessageRole.ASSISTANT and skip_next_assistant:
+                skip_next_assistant = False
+                continue
+            final.append(msg)
+            if events:
+                skip_next_assistant = True
+                final.extend(_event_to_message(event) for event in events)
+
+        return final
 
     def add_message(
         self,
@@ -212,43 +302,105 @@ class ChatManager:
         role: str,
         content: str,
         tokens_input: int = 0,
-        tokens_output: int = 0
+        tokens_output: int = 0,
+        session: Optional[Session] = None,
     ) -> int:
         """Add a message to a chat.
 
         Returns:
             Created Message ID
         """
-        with get_session() as session:
-            # Get next sequence
-            from sqlalchemy import func
-            max_seq = session.query(func.max(Message.sequence)).filter(
-                Message.chat_id == chat_id
-            ).scalar() or 0
-
-            msg = Message(
-                chat_id=chat_id,
-                role=MessageRole(role),
-                content=content,
-                sequence=max_seq + 1,
-                tokens_input=tokens_input,
-                tokens_output=tokens_output,
-            )
-            session.add(msg)
-            session.flush()
-            return msg.id
+        return self.add_messages(chat_id, [{
+            'role': role,
+            'content': content,
+            'tokens_input': tokens_input,
+            'tokens_output': tokens_output,
+        }], session=session)[0]
+
+    def add_messages(
+        self,
+        chat_id: int,
+        messages: list[dict],
+        session: Optional[Session] = None,
+    ) -> list[int]:
+        """Add several messages to a chat in one INSERT, in order.
+
+        Sequences are computed by the INSERT itself, and the chat's
+        message_count / max_sequence / last_message_at / rendered_history
+        are updated in the same transaction. A concurrent writer
+        taking the same sequence hits the (chat_id, sequence) unique index
+        and the insert is retried (inside a savepoint when `session` is
+        shared with the caller).
+
+        Args:
+            chat_id: Chat ID
+            messages: Dicts with role, content and optional tokens_input/tokens_output
+            session: Optional session to run in (caller commits)
 
-    def get_history(self, chat_id: int) -> list[dict]:
+        Returns:
+            Created Message IDs, in the order given
+        """
+        if not messages:
+            return []
+
+        for attempt in range(3):
+            try:
+                with get_session(session) as s, (
+                    s.begin_nested() if session is not None else nullcontext()
+                ):
+                    next_sequence = select(
+                        func.coalesce(func.max(Message.sequence), 0) + 1
+                    ).where(Message.chat_id == chat_id).scalar_subquery()
+
+                    rows = s.execute(
+                        insert(Message).values([
+                            {
+                                'chat_id': chat_id,
+                                'role': MessageRole(m['role']),
+                                'content': m['content'],
+                                'sequence': next_sequence + i,
+                                'tokens_input': m.get('tokens_input', 0),
+                                'tokens_output': m.get('tokens_output', 0),
+                            }
+                            for i, m in enumerate(messages)
+                        ]).returning(Message.id, Message.sequence)
+                    ).all()
+                    rows.sort(key=lambda r: r.sequence)
+
+                    # Keep the chat's message stats in the same transaction
+                    s.execute(
+                        update(Chat).where(Chat.id == chat_id).values(
+                            message_count=Chat.message_count + len(rows),
+                            max_sequence=func.greatest(Chat.max_sequence, rows[-1].sequence),
+                            last_message_at=datetime.utcnow(),
+                            # NULL (not maintained for this chat) stays NULL
+                            rendered_history=Chat.rendered_history + render_messages(messages),
+                            updated_at=Chat.updated_at,
+                        )
+                    )
+                    return [row.id for row in rows]
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+
+    def get_history(self, chat_id: int, session: Optional[Session] = None) -> list[dict]:
         """Get message history as role+content pairs (for agent context)."""
-        with get_session() as session:
-            messages = session.query(Message).filter(
-                Message.chat_id == chat_id
-            ).order_by(Message.sequence).all()
+        with get_session(session) as session:
+            rows = session.execute(_history_stmt, {'chat_id': chat_id})
             return [
-                {"role": m.role.value, "content": m.content}
-                for m in messages
+                {"role": role.value, "content": content}
+                for role, content in rows
             ]
 
+    def get_rendered_history(self, chat_id: int, session: Optional[Session] = None) -> Optional[str]:
+        """History already rendered as agent context (see render_messages).
+
+        Returns:
+            Rendered history, or None if the chat does not keep one (use get_history)
+        """
+        with get_session(session) as session:
+            return session.execute(_rendered_history_stmt, {'chat_id': chat_id}).scalar()
+
     def get_usage(self, tenant: Optional[str] = None, since: Optional[date] = None, until: Optional[date] = None) -> dict:
         """Aggregate token usage across messages.
 
@@ -314,7 +466,7 @@ class ChatManager:
         """
         allowed = {'system_prompt', 'workspace', 'allowed_tools', 'max_turns', 'metadata'}
         with get_session() as session:
-            chat = session.query(Chat).get(chat_id)
+            chat = session.get(Chat, chat_id)
             if not chat:
                 return False
             for key, value in kwargs.items():
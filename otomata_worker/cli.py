@@ -29,7 +29,7 @@ app.add_typer(db_app, name="db")
 def run(
     workspace: str = typer.Option(None, "--workspace", "-w", help="Workspace directory"),
     worker_id: str = typer.Option(None, "--id", help="Worker ID"),
-    poll_interval: int = typer.Option(5, "--interval", "-i", help="Poll interval in seconds")
+    poll_interval: int = typer.Option(5, "--interval", "-i", help="Max idle poll interval in seconds")
 ):
     """Run the worker loop (poll only, no API)."""
     from .worker import run_worker
@@ -86,7 +86,8 @@ def task_create(
 @task_app.command("list")
 def task_list(
     status: str = typer.Option(None, "--status", "-s", help="Filter by status"),
-    limit: int = typer.Option(20, "--limit", "-l", help="Max tasks to show")
+    limit: int = typer.Option(20, "--limit", "-l", help="Max tasks to show"),
+    cursor: Optional[int] = typer.Option(None, "--cursor", "-c", help="Show tasks older than this task ID"),
 ):
     """List tasks."""
     from .task_manager import TaskManager
@@ -94,7 +95,6 @@ def task_list(
 
     tm = TaskManager()
     filter_status = TaskStatus(status) if status else None
-    tasks = tm.list_tasks(status=filter_status, limit=limit)
 
     table = Table(title="Tasks")
     table.add_column("ID", style="cyan")
@@ -103,7 +103,8 @@ def task_list(
     table.add_column("Worker")
     table.add_column("Created")
 
-    for t in tasks:
+    last_id = None
+    for t in tm.iter_tasks(status=filter_status, limit=limit, cursor=cursor):
         status_style = {
             'pending': 'yellow',
             'running': 'blue',
@@ -118,8 +119,11 @@ def task_list(
             t['claimed_by'] or '',
             t['created_at'][:19] if t['created_at'] else ''
         )
+        last_id = t['id']
 
-    console.print(table)
+    console.print(table, overflow='ellipsis')
+    if last_id is not None and table.row_count == limit:
+        console.print(f"[dim]Next page: --cursor {last_id}[/dim]")
 
 
 @task_app.command("status")
@@ -372,41 +376,248 @@ def db_init():
 
 
 @db_app.command("migrate")
-def db_migrate():
-    """Run migrations (add missing columns/tables)."""
+def db_migrate(
+    force: bool = typer.Option(False, "--force", help="Also drop columns no longer in the models"),
+    unlogged_events: Optional[bool] = typer.Option(
+        None, "--unlogged-events/--logged-events",
+        help="Make task_events UNLOGGED (no WAL, emptied after a crash, not replicated) or logged again",
+    ),
+):
+    """Run migrations (add missing tables, columns and indexes).
+
+    Additive and idempotent: existing data is never dropped unless --force.
+    """
+    import time
     from .database import get_db_engine
-    from .models import Base, Chat
+    from .models import Base, TASK_NOTIFY_DDL
     from sqlalchemy import inspect, text
+    from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+    from sqlalchemy.schema import CreateColumn
 
     engine = get_db_engine()
     inspector = inspect(engine)
-    expected_chat_cols = {'id', 'tenant', 'metadata', 'system_prompt', 'workspace', 'allowed_tools', 'max_turns', 'created_at', 'updated_at'}
-
-    # Check if chats table exists with old schema (needs drop+recreate)
-    if 'chats' in inspector.get_table_names():
-        actual_cols = {c['name'] for c in inspector.get_columns('chats')}
-        missing = expected_chat_cols - actual_cols
-        if missing:
-            console.print(f"[yellow]chats table missing columns: {missing} — recreating[/yellow]")
-            with engine.begin() as conn:
-                conn.execute(text("DROP TABLE IF EXISTS task_events CASCADE"))
-                conn.execute(text("DROP TABLE IF EXISTS messages CASCADE"))
-                conn.execute(text("DROP TABLE IF EXISTS chats CASCADE"))
-
-    # Add chat_id to tasks if missing
-    if 'tasks' in inspector.get_table_names():
-        columns = [c['name'] for c in inspector.get_columns('tasks')]
-        if 'chat_id' not in columns:
-            with engine.begin() as conn:
-                conn.execute(text("ALTER TABLE tasks ADD COLUMN chat_id INTEGER REFERENCES chats(id)"))
-                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_tasks_chat_id ON tasks(chat_id)"))
-            console.print("[green]Added chat_id to tasks[/green]")
+    existing_tables = set(inspector.get_table_names())
+    added = set()
 
     # Create new/missing tables
     Base.metadata.create_all(engine)
+
+    # Add model columns missing from existing tables
+    stale_columns = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        actual_cols = {c['name'] for c in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name in actual_cols:
+                continue
+            ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+            for fk in column.foreign_keys:
+                ddl += f" REFERENCES {fk.column.table.name}({fk.column.name})"
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            added.add(f"{table.name}.{column.name}")
+            console.print(f"[green]Added {table.name}.{column.name}[/green]")
+
+        stale = actual_cols - set(table.columns.keys())
+        if stale:
+            stale_columns[table.name] = stale
+
+    # chats.metadata is JSONB (containment filter + GIN index)
+    metadata_col = next(c for c in inspect(engine).get_columns('chats') if c['name'] == 'metadata')
+    if not isinstance(metadata_col['type'], JSONB):
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE chats ALTER COLUMN metadata TYPE jsonb USING metadata::jsonb"))
+        console.print("[green]Converted chats.metadata to jsonb[/green]")
+
+    # Backfill chat message stats when the columns are new
+    if 'chats.message_count' in added:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE chats c
+                SET message_count = s.count, max_sequence = s.max_sequence, last_message_at = s.last_at
+                FROM (
+                    SELECT chat_id, count(*) AS count, max(sequence) AS max_sequence, max(created_at) AS last_at
+                    FROM messages GROUP BY chat_id
+                ) s
+                WHERE c.id = s.chat_id
+            """))
+        console.print("[green]Backfilled chat message stats[/green]")
+
+    # Render the agent context of existing chats once (then appended to)
+    if 'chats.rendered_history' in added:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE chats c
+                SET rendered_history = COALESCE((
+                    SELECT string_agg(
+                        CASE WHEN m.role = 'user' THEN 'User: ' ELSE 'Assistant: ' END
+                            || COALESCE(m.content, '') || E'\\n\\n',
+                        '' ORDER BY m.sequence
+                    )
+                    FROM messages m WHERE m.chat_id = c.id
+                ), '')
+            """))
+        console.print("[green]Backfilled chat rendered history[/green]")
+
+    # Seed the hourly window counters from the old list of request timestamps
+    if 'rate_limits.hourly_current_count' in added and 'hourly_timestamps' in stale_columns.get('rate_limits', ()):
+        hourly_col = next(c for c in inspect(engine).get_columns('rate_limits') if c['name'] == 'hourly_timestamps')
+        if isinstance(hourly_col['type'], ARRAY):
+            timestamps = "SELECT ts FROM unnest(r.hourly_timestamps) ts"
+        else:
+            timestamps = (
+                "SELECT extract(epoch FROM value::timestamp)::bigint AS ts"
+                " FROM json_array_elements_text(r.hourly_timestamps::json)"
+            )
+        window_start = int(time.time()) // 3600 * 3600
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                UPDATE rate_limits r SET
+                    hourly_window_start = to_timestamp(:window_start) AT TIME ZONE 'UTC',
+                    hourly_current_count = (SELECT count(*) FROM ({timestamps}) t WHERE ts >= :window_start),
+                    hourly_previous_count = (
+                        SELECT count(*) FROM ({timestamps}) t WHERE ts >= :window_start - 3600 AND ts < :window_start
+                    )
+            """), {'window_start': window_start})
+        console.print("[green]Backfilled rate_limits hourly window counters[/green]")
+
+    # Columns no longer in the models (after backfills that read them)
+    for table_name, stale in stale_columns.items():
+        if force:
+            with engine.begin() as conn:
+                for name in sorted(stale):
+                    conn.execute(text(f'ALTER TABLE {table_name} DROP COLUMN "{name}"'))
+            console.print(f"[yellow]Dropped {table_name} columns: {sorted(stale)}[/yellow]")
+        else:
+            console.print(f"[yellow]{table_name} has columns not in the models: {sorted(stale)} (use --force to drop)[/yellow]")
+
+    # Indexes superseded by composite ones
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_identities_platform"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_secrets_key"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_tasks_claimed_by"))
+
+    # rate_limits is unique per identity/action/day: merge racing duplicates first
+    if 'rate_limits' in existing_tables and not any(
+        i['name'] == 'ix_ratelimit_identity_action_date' for i in inspector.get_indexes('rate_limits')
+    ):
+        with engine.begin() as conn:
+            merged = conn.execute(text("""
+                WITH dupes AS (
+                    SELECT identity_id, action_type, date, max(id) AS keep_id,
+                           sum(daily_count) AS daily_count, max(last_request_at) AS last_request_at
+                    FROM rate_limits GROUP BY identity_id, action_type, date HAVING count(*) > 1
+                ), kept AS (
+                    UPDATE rate_limits r
+                    SET daily_count = d.daily_count, last_request_at = d.last_request_at
+                    FROM dupes d WHERE r.id = d.keep_id
+                )
+                DELETE FROM rate_limits r USING dupes d
+                WHERE r.identity_id = d.identity_id AND r.action_type = d.action_type
+                  AND r.date = d.date AND r.id <> d.keep_id
+            """)).rowcount
+        if merged:
+            console.print(f"[yellow]Merged {merged} duplicate rate_limits rows[/yellow]")
+
+    # secrets are unique per key/scope/owner: keep the latest write of duplicates
+    if 'secrets' in existing_tables and not any(
+        i['name'] == 'ix_secret_lookup' for i in inspector.get_indexes('secrets')
+    ):
+        with engine.begin() as conn:
+            removed = conn.execute(text("""
+                DELETE FROM secrets s USING (
+                    SELECT id, row_number() OVER (
+                        PARTITION BY key, scope, coalesce(user_id, 0)
+                        ORDER BY updated_at DESC NULLS LAST, id DESC
+                    ) AS rank
+                    FROM secrets
+                ) d
+                WHERE s.id = d.id AND d.rank > 1
+            """)).rowcount
+        if removed:
+            console.print(f"[yellow]Removed {removed} duplicate secrets[/yellow]")
+
+    # Sequences are unique per chat/task: renumber rows that raced on max+1
+    for table_name, parent, index_name in (
+        ('messages', 'chat_id', 'ix_messages_chat_sequence'),
+        ('task_events', 'task_id', 'ix_task_events_task_sequence'),
+    ):
+        if table_name not in existing_tables or any(
+            i['name'] == index_name for i in inspector.get_indexes(table_name)
+        ):
+            continue
+        with engine.begin() as conn:
+            renumbered = conn.execute(text(f"""
+                UPDATE {table_name} t SET sequence = r.sequence
+                FROM (
+                    SELECT id, row_number() OVER (PARTITION BY {parent} ORDER BY sequence, id) AS sequence
+                    FROM {table_name}
+                    WHERE sequence IS NOT NULL AND {parent} IN (
+                        SELECT {parent} FROM {table_name} WHERE sequence IS NOT NULL
+                        GROUP BY {parent}, sequence HAVING count(*) > 1
+                    )
+                ) r
+                WHERE t.id = r.id AND t.sequence <> r.sequence
+            """)).rowcount
+            if table_name == 'messages' and renumbered:
+                conn.execute(text("""
+                    UPDATE chats c SET max_sequence = s.max_sequence
+                    FROM (SELECT chat_id, max(sequence) AS max_sequence FROM messages GROUP BY chat_id) s
+                    WHERE c.id = s.chat_id AND c.max_sequence < s.max_sequence
+                """))
+        if renumbered:
+            console.print(f"[yellow]Renumbered {renumbered} {table_name} rows with duplicate sequences[/yellow]")
+
+    # Create indexes declared on models but missing from existing tables
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    # NOTIFY trigger waking idle workers (created with the table on new installs)
+    with engine.begin() as conn:
+        for ddl in TASK_NOTIFY_DDL:
+            conn.execute(ddl)
+
+    # task_events durability (SSE replay + tool history; tasks keep their result)
+    if unlogged_events is not None:
+        mode = "UNLOGGED" if unlogged_events else "LOGGED"
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE task_events SET {mode}"))
+        console.print(f"[green]task_events is now {mode}[/green]")
     console.print("[green]Migration complete[/green]")
 
 
+@db_app.command("purge-events")
+def db_purge_events(
+    days: int = typer.Option(30, "--days", "-d", help="Delete task events older than this many days"),
+):
+    """Delete old task events (SSE replay and chat tool history)."""
+    from datetime import datetime, timedelta
+    from .database import get_session
+    from .models import TaskEvent
+    from sqlalchemy import delete
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with get_session() as session:
+        deleted = session.execute(
+            delete(TaskEvent).where(TaskEvent.created_at < cutoff)
+        ).rowcount
+    console.print(f"[green]Deleted {deleted} task events older than {days} days[/green]")
+
+
+@db_app.command("purge-rate-limits")
+def db_purge_rate_limits(
+    days: int = typer.Option(7, "--days", "-d", help="Delete rate-limit records older than this many days"),
+):
+    """Delete old rate-limit records (run daily, e.g. from cron)."""
+    from .rate_limiter import DBRateLimiter
+
+    deleted = DBRateLimiter().purge(days)
+    console.print(f"[green]Deleted {deleted} rate-limit records older than {days} days[/green]")
+
+
 @db_app.command("url")
 def db_url():
     """Show current DATABASE_URL."""
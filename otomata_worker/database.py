@@ -1,6 +1,9 @@
 """Database session management for PostgreSQL."""
 
 from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import orm
 from sqlalchemy.orm import sessionmaker
 
 from .models import get_engine, init_db as models_init_db
@@ -26,8 +29,16 @@ def get_session_factory():
 
 
 @contextmanager
-def get_session():
-    """Context manager for database sessions."""
+def get_session(session: Optional[orm.Session] = None):
+    """Context manager for database sessions.
+
+    If `session` is given it is reused as-is: the caller that opened it
+    owns the transaction and commits or rolls back once for all calls.
+    """
+    if session is not None:
+        yield session
+        return
+
     Session = get_session_factory()
     session = Session()
     try:
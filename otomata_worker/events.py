@@ -2,76 +2,435 @@
 
 import json
 import asyncio
-from datetime import datetime
-from collections import defaultdict
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from collections import OrderedDict, deque
+from typing import Optional
+
+from sqlalchemy import bindparam, func, insert, lambda_stmt, select
 
 from .models import TaskEvent
 from .database import get_session
 
 
-class TaskEventStore:
-    """Store and retrieve task events for SSE streaming."""
+# Statements run on every batch / replay, built once (compiled SQL is cached)
+_last_sequence_stmt = lambda_stmt(lambda: select(
+    TaskEvent.task_id, func.max(TaskEvent.sequence)
+).where(
+    TaskEvent.task_id.in_(bindparam('task_ids', expanding=True))
+).group_by(TaskEvent.task_id))
 
-    def __init__(self):
-        self.events: dict[int, list[dict]] = defaultdict(list)
-        self.event_signals: dict[int, asyncio.Event] = {}
+_persisted_stmt = lambda_stmt(lambda: select(
+    TaskEvent.event_type, TaskEvent.event_data, TaskEvent.created_at
+).where(
+    TaskEvent.task_id == bindparam('task_id'),
+    TaskEvent.created_at >= bindparam('since'),
+).order_by(TaskEvent.sequence))
 
-    def add_event(self, task_id: int, event_type: str, data: dict):
-        """Add an event for a task (in-memory + DB)."""
-        event = {
-            'type': event_type,
-            'timestamp': datetime.utcnow().isoformat(),
-            **data
-        }
-        self.events[task_id].append(event)
-
-        # Persist to DB
-        self._save_to_db(task_id, event_type, data)
-
-        # Signal waiting listeners
-        if task_id in self.event_signals:
-            self.event_signals[task_id].set()
-
-    def _save_to_db(self, task_id: int, event_type: str, data: dict):
-        """Persist event to database."""
+
+# Event types written to the DB as-is. `text` chunks are coalesced into one
+# row per assistant turn; anything else (e.g. `thinking`) is SSE-only.
+PERSISTED_EVENT_TYPES = frozenset({'start', 'tool_use', 'status', 'error', 'complete'})
+
+
+def summarize_tool_use(data: dict) -> str:
+    """One-line description of a tool_use event (e.g. "Bash: ls -la")."""
+    detail = data.get('tool', 'tool')
+    inp = data.get('input', {})
+    if detail == 'Bash' and isinstance(inp, dict) and inp.get('command'):
+        cmd = inp['command']
+        detail = f"Bash: {cmd[:80]}..." if len(cmd) > 80 else f"Bash: {cmd}"
+    elif detail in ('Read', 'Write', 'Edit') and isinstance(inp, dict) and inp.get('file_path'):
+        detail = f"{detail}: {inp['file_path']}"
+    elif detail in ('Glob', 'Grep') and isinstance(inp, dict) and inp.get('pattern'):
+        detail = f"{detail}: {inp['pattern']}"
+    return detail
+
+
+class BufferedEventWriter:
+    """Persist task events in batches from a background thread.
+
+    Events are queued and written when `batch_size` events are pending or
+    `flush_interval_ms` has elapsed since the first one, whichever comes
+    first. Each batch is one multi-row INSERT in a single transaction.
+    """
+
+    def __init__(self, batch_size: int = 64, flush_interval_ms: int = 100):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def put(self, task_id: int, event_type: str, data: dict, created_at: datetime):
+        """Queue an event for persistence (non-blocking)."""
+        self._ensure_started()
+        self._queue.put((task_id, event_type, data, created_at))
+
+    def flush(self, timeout: float = 10.0):
+        """Block until every event queued so far is written."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="event-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.flush_interval
+
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch: list[tuple]):
+        """Insert a batch, numbering events after each task's current max sequence."""
+        task_ids = {task_id for task_id, _, _, _ in batch}
         try:
             with get_session() as session:
-                from sqlalchemy import func
-                max_seq = session.query(func.max(TaskEvent.sequence)).filter(
-                    TaskEvent.task_id == task_id
-                ).scalar() or 0
-
-                event = TaskEvent(
-                    task_id=task_id,
-                    event_type=event_type,
-                    event_data=data,
-                    sequence=max_seq + 1
-                )
-                session.add(event)
+                last_sequence = dict(session.execute(
+                    _last_sequence_stmt, {'task_ids': list(task_ids)}
+                ).all())
+
+                rows = []
+                for task_id, event_type, data, created_at in batch:
+                    sequence = (last_sequence.get(task_id) or 0) + 1
+                    last_sequence[task_id] = sequence
+                    rows.append({
+                        'task_id': task_id,
+                        'event_type': event_type,
+                        'event_data': data,
+                        'display_summary': summarize_tool_use(data) if event_type == 'tool_use' else None,
+                        'sequence': sequence,
+                        'created_at': created_at,
+                    })
+
+                session.execute(insert(TaskEvent), rows)
         except Exception as e:
-            print(f"[EventStore] Failed to save event to DB: {e}")
+            print(f"[EventStore] Failed to save {len(batch)} events to DB: {e}")
+
+
+class _TaskBuffer:
+    """Most recent events of one task, plus how many were emitted in total."""
+
+    __slots__ = ('events', 'total', 'started_at', 'pending_text')
+
+    def __init__(self, maxlen: int, started_at: datetime):
+        self.events: deque[dict] = deque(maxlen=maxlen)
+        self.total = 0
+        self.started_at = started_at
+        # Text of the current turn not yet persisted: (data, parts, created_at)
+        self.pending_text: Optional[tuple[dict, list[str], datetime]] = None
+
+    @property
+    def head(self) -> int:
+        """Absolute index of the oldest event still in memory."""
+        return self.total - len(self.events)
+
+
+class Subscriber:
+    """Listener of one task's events, fed through a bounded queue on its own loop.
+
+    Items are `(start_index, events)` batches, or None once the task
+    finished. A listener that falls `maxsize` batches behind stops being
+    fed and gets `overflowed` set: it should catch up with `read`.
+    """
+
+    __slots__ = ('loop', 'queue', 'overflowed', 'closed')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+        self.closed = False
+
+    def offer(self, item: Optional[tuple[int, list[dict]]]):
+        """Queue a batch, or None when the task finished (runs on `loop`)."""
+        if item is None:
+            self.closed = True
+        if self.queue.full():
+            if item is not None:
+                self.overflowed = True
+            return
+        self.queue.put_nowait(item)
+
+
+class TaskEventStore:
+    """Store and retrieve task events for SSE streaming.
+
+    Memory is bounded: each task keeps its last `max_events` events and
+    only the `max_tasks` most recently active tasks are kept. Readers that
+    fall behind the in-memory tail are served the gap from the DB.
+
+    Only PERSISTED_EVENT_TYPES reach the DB, plus one `text` row per
+    assistant turn (chunks are concatenated until the next non-text event,
+    a new turn, or cleanup).
+
+    Listeners either `subscribe` (events are pushed to their queue) or
+    poll with `read` + `wait_for_event`. `cleanup` also marks the task
+    finished and wakes its listeners, so streams of tasks run in this
+    process end without polling the DB.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 64,
+        flush_interval_ms: int = 100,
+        max_events: int = 1024,
+        max_tasks: int = 512,
+    ):
+        self.max_events = max_events
+        self.max_tasks = max_tasks
+        self.events: OrderedDict[int, _TaskBuffer] = OrderedDict()
+        self.conditions: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Condition]] = {}
+        self.subscribers: dict[int, list[Subscriber]] = {}
+        # Recently finished tasks (bounded like `events`)
+        self.finished: OrderedDict[int, None] = OrderedDict()
+        self.writer = BufferedEventWriter(batch_size, flush_interval_ms)
+        self._lock = threading.Lock()
+
+    def add_event(self, task_id: int, event_type: str, data: dict):
+        """Add an event for a task (in-memory now, DB in the next batch)."""
+        self.add_events(task_id, [(event_type, data)])
+
+    def add_events(self, task_id: int, events: list[tuple[str, dict]]):
+        """Add several events for a task at once, in order.
+
+        One lock acquisition and one listener wake-up for the whole list.
+        """
+        if not events:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # naive UTC, like the DB columns
+        timestamp = now.isoformat()
+        with self._lock:
+            buffer = self.events.get(task_id)
+            if buffer is None:
+                buffer = self.events[task_id] = _TaskBuffer(self.max_events, now)
+                self.finished.pop(task_id, None)  # retried
+                while len(self.events) > self.max_tasks:
+                    evicted_id, evicted = self.events.popitem(last=False)
+                    self._flush_text(evicted_id, evicted)
+            else:
+                self.events.move_to_end(task_id)
+
+            start = buffer.total
+            added = []
+            for event_type, data in events:
+                event = {'type': event_type, 'timestamp': timestamp, **data}
+                added.append(event)
+                buffer.events.append(event)
+                buffer.total += 1
+
+                # Persist to DB (queued in order, written by the next batch)
+                if event_type == 'text':
+                    pending = buffer.pending_text
+                    if pending is not None and pending[0].get('turn') == data.get('turn'):
+                        pending[1].append(data.get('content', ''))
+                    else:
+                        self._flush_text(task_id, buffer)
+                        buffer.pending_text = (data, [data.get('content', '')], now)
+                else:
+                    self._flush_text(task_id, buffer)
+                    if event_type in PERSISTED_EVENT_TYPES:
+                        self.writer.put(task_id, event_type, data, now)
+
+            # Push to subscribers (under the lock, so batches stay in order)
+            for subscriber in self.subscribers.get(task_id, ()):
+                if not subscriber.loop.is_closed():
+                    subscriber.loop.call_soon_threadsafe(subscriber.offer, (start, added))
+
+        self._wake(self.conditions.get(task_id))
+
+    def _wake(self, waiting: Optional[tuple[asyncio.AbstractEventLoop, asyncio.Condition]]):
+        """Wake the listeners of a task (they may live on another thread's loop)."""
+        if waiting is not None:
+            loop, condition = waiting
+            if not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self._notify_all(condition), loop)
+
+    def _flush_text(self, task_id: int, buffer: _TaskBuffer):
+        """Queue the buffered text of the current turn as one event row."""
+        if buffer.pending_text is None:
+            return
+        data, parts, created_at = buffer.pending_text
+        buffer.pending_text = None
+        self.writer.put(task_id, 'text', {**data, 'content': ''.join(parts)}, created_at)
+
+    @staticmethod
+    async def _notify_all(condition: asyncio.Condition):
+        async with condition:
+            condition.notify_all()
+
+    def version(self, task_id: int) -> int:
+        """Number of events emitted so far for a task."""
+        buffer = self.events.get(task_id)
+        return buffer.total if buffer else 0
+
+    async def subscribe(self, task_id: int, after_index: int = 0, maxsize: int = 256) -> tuple[Subscriber, list[dict], int]:
+        """Register a listener for a task (await from the listener's event loop).
+
+        Returns:
+            Tuple of (subscriber, events after `after_index`, index after them).
+            Queued batches may overlap those events: skip up to the index.
+        """
+        subscriber = Subscriber(asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            self.subscribers.setdefault(task_id, []).append(subscriber)
+            subscriber.closed = task_id in self.finished
+        events, index = await self.read_async(task_id, after_index)
+        return subscriber, events, index
+
+    def unsubscribe(self, task_id: int, subscriber: Subscriber):
+        """Stop feeding a listener."""
+        with self._lock:
+            subscribers = self.subscribers.get(task_id)
+            if subscribers and subscriber in subscribers:
+                subscribers.remove(subscriber)
+                if not subscribers:
+                    del self.subscribers[task_id]
+
+    def is_finished(self, task_id: int) -> bool:
+        """Whether the task was cleaned up (finished) in this process."""
+        return task_id in self.finished
+
+    def is_tracked(self, task_id: int) -> bool:
+        """Whether this process has events for the task or saw it finish."""
+        return task_id in self.events or task_id in self.finished
 
     def get_events(self, task_id: int, after_index: int = 0) -> list[dict]:
         """Get events for a task after a given index."""
-        return self.events[task_id][after_index:]
+        return self.read(task_id, after_index)[0]
+
+    def read(self, task_id: int, after_index: int = 0) -> tuple[list[dict], int]:
+        """Get events for a task after a given index, and the index to resume from.
 
-    async def wait_for_event(self, task_id: int, timeout: float = 30.0) -> bool:
-        """Wait for a new event on this task. Returns True if event arrived."""
-        if task_id not in self.event_signals:
-            self.event_signals[task_id] = asyncio.Event()
+        A reader behind the in-memory tail is replayed the persisted events
+        of the gap instead. Those are coalesced (one text row per turn, no
+        SSE-only events), so they cannot be matched to in-memory indices:
+        the whole gap is sent and may repeat events already delivered.
+        """
+        events, index, gap = self._read_tail(task_id, after_index)
+        if gap is None:
+            return events, index
+        # Reader is behind the in-memory tail: replay the gap from the DB
+        return self._load_persisted(task_id, *gap) + events, index
+
+    async def read_async(self, task_id: int, after_index: int = 0) -> tuple[list[dict], int]:
+        """`read` for event loops: a DB replay (and its writer flush) runs in a thread."""
+        events, index, gap = self._read_tail(task_id, after_index)
+        if gap is None:
+            return events, index
+        persisted = await asyncio.to_thread(self._load_persisted, task_id, *gap)
+        return persisted + events, index
+
+    def _read_tail(self, task_id: int, after_index: int) -> tuple[list[dict], int, Optional[tuple]]:
+        """In-memory events after `after_index`, the index to resume from, and
+        the (since, before) window to replay from the DB when the reader is
+        behind the in-memory tail (None otherwise)."""
+        with self._lock:
+            buffer = self.events.get(task_id)
+            if buffer is None:
+                return [], after_index, None
+            head = buffer.head
+            total = buffer.total
+            started_at = buffer.started_at
+            tail = list(buffer.events)
+            head_at = datetime.fromisoformat(tail[0]['timestamp']) if tail else None
+
+        if after_index >= head:
+            return tail[after_index - head:], total, None
+        return tail, total, (started_at, head_at)
+
+    def _load_persisted(self, task_id: int, since: datetime, before: Optional[datetime]) -> list[dict]:
+        """Load persisted events emitted in [since, before), oldest first."""
+        self.writer.flush()
+        with get_session() as session:
+            query = _persisted_stmt
+            params = {'task_id': task_id, 'since': since}
+            if before is not None:
+                query = query + (lambda q: q.where(TaskEvent.created_at < bindparam('before')))
+                params['before'] = before
+            rows = session.execute(query, params).all()
+
+        return [
+            {'type': event_type, 'timestamp': created_at.isoformat(), **(data or {})}
+            for event_type, data, created_at in rows
+        ]
+
+    async def wait_for_event(self, task_id: int, last_seen: int, timeout: float = 30.0) -> int:
+        """Wait until the task has more than `last_seen` events or is finished.
+
+        Returns the current version (event count); unchanged on timeout.
+        """
+        with self._lock:
+            waiting = self.conditions.get(task_id)
+            if waiting is None:
+                waiting = self.conditions[task_id] = (asyncio.get_running_loop(), asyncio.Condition())
+        condition = waiting[1]
 
         try:
-            await asyncio.wait_for(self.event_signals[task_id].wait(), timeout)
-            self.event_signals[task_id].clear()
-            return True
+            async with condition:
+                await asyncio.wait_for(
+                    condition.wait_for(
+                        lambda: self.version(task_id) > last_seen or task_id in self.finished
+                    ),
+                    timeout,
+                )
         except asyncio.TimeoutError:
-            return False
+            pass
+        if task_id in self.finished:
+            with self._lock:
+                self.conditions.pop(task_id, None)
+        return self.version(task_id)
 
     def cleanup(self, task_id: int):
-        """Free memory for completed task."""
-        self.events.pop(task_id, None)
-        self.event_signals.pop(task_id, None)
+        """Free memory for completed task and wake its listeners (pending DB writes are flushed first)."""
+        with self._lock:
+            buffer = self.events.pop(task_id, None)
+            if buffer is not None:
+                self._flush_text(task_id, buffer)
+            waiting = self.conditions.pop(task_id, None)
+            for subscriber in self.subscribers.pop(task_id, ()):
+                if not subscriber.loop.is_closed():
+                    subscriber.loop.call_soon_threadsafe(subscriber.offer, None)
+            self.finished[task_id] = None
+            self.finished.move_to_end(task_id)
+            while len(self.finished) > self.max_tasks:
+                self.finished.popitem(last=False)
+        self.writer.flush()
+        self._wake(waiting)
 
 
 # Global singleton
 event_store = TaskEventStore()
+atexit.register(event_store.writer.flush)
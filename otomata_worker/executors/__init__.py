@@ -1,6 +1,26 @@
 """Task executors."""
 
-from .script import execute_script
-from .agent import execute_agent
+from importlib import import_module
 
-__all__ = ["execute_script", "execute_agent"]
+# Loaded on first access so importing one executor does not pull in the other
+_LAZY = {
+    "execute_script": "script",
+    "execute_script_async": "script",
+    "execute_agent": "agent",
+    "run_agents_batch": "agent",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
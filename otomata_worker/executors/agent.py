@@ -2,10 +2,131 @@
 
 import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any, List
 
 from ..models import Task
 from ..events import event_store
+from ..chat_manager import render_messages
+
+
+# Rendered history per chat: chat_id -> (number of messages rendered, text).
+# Chat history is append-only, so a later call only renders the new messages.
+_HISTORY_CACHE_SIZE = 256
+_history_cache: OrderedDict[int, tuple[int, str]] = OrderedDict()
+_history_lock = threading.Lock()
+
+
+class _EventBatcher:
+    """Buffer a task's events and add them to the event store in batches.
+
+    Flushes when `max_events` are buffered, when the oldest is older than
+    `max_delay_ms` at the next add, on `flush()`, and on exit (also on error).
+
+    Flushed batches go through a bounded queue drained by a background
+    task, so the agent loop does not wait on the event store. If the queue
+    is full, the batch's `text`/`thinking` events are dropped (the task
+    output keeps the full text) and the rest waits for room. Exit returns
+    once every batch is delivered.
+    """
+
+    DROPPABLE = frozenset({'text', 'thinking'})
+
+    def __init__(
+        self,
+        task_id: int,
+        enabled: bool = True,
+        max_events: int = 16,
+        max_delay_ms: int = 50,
+        max_batches: int = 1024,
+    ):
+        self.task_id = task_id
+        self.enabled = enabled
+        self.max_events = max_events
+        self.max_delay = max_delay_ms / 1000
+        self.max_batches = max_batches
+        self.dropped = 0
+        self._pending: List[tuple] = []
+        self._first_at = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._drainer: Optional[asyncio.Task] = None
+
+    async def add(self, event_type: str, data: dict):
+        if not self.enabled:
+            return
+        if not self._pending:
+            self._first_at = time.monotonic()
+        self._pending.append((event_type, data))
+        if len(self._pending) >= self.max_events or time.monotonic() - self._first_at >= self.max_delay:
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            self._queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            kept = [event for event in batch if event[0] not in self.DROPPABLE]
+            self.dropped += len(batch) - len(kept)
+            if kept:
+                await self._queue.put(kept)
+
+    async def _drain(self):
+        while True:
+            batch = await self._queue.get()
+            try:
+                event_store.add_events(self.task_id, batch)
+            except Exception as e:
+                print(f"[task-{self.task_id}] Failed to emit {len(batch)} events: {e}", flush=True)
+            finally:
+                self._queue.task_done()
+
+    async def __aenter__(self):
+        if self.enabled:
+            self._queue = asyncio.Queue(maxsize=self.max_batches)
+            self._drainer = asyncio.create_task(self._drain())
+        return self
+
+    async def __aexit__(self, *exc):
+        if not self.enabled:
+            return
+        try:
+            await self.flush()
+            await self._queue.join()
+        finally:
+            self._drainer.cancel()
+        if self.dropped:
+            print(f"[task-{self.task_id}] Dropped {self.dropped} text events (event queue full)", flush=True)
+
+
+def render_history(history: List[dict], chat_id: Optional[int] = None) -> str:
+    """Render history as "User: ...\n\nAssistant: ..." (cached per chat).
+
+    Args:
+        history: Messages [{"role": "user"|"assistant", "content": str}]
+        chat_id: Chat the history belongs to; enables incremental rendering
+
+    Returns:
+        Rendered conversation
+    """
+    if chat_id is None:
+        return render_messages(history)[:-2]
+
+    with _history_lock:
+        count, text = _history_cache.get(chat_id, (0, ""))
+    if count > len(history):
+        count, text = 0, ""
+    if count < len(history):
+        text += render_messages(history[count:])
+        with _history_lock:
+            _history_cache[chat_id] = (len(history), text)
+            _history_cache.move_to_end(chat_id)
+            while len(_history_cache) > _HISTORY_CACHE_SIZE:
+                _history_cache.popitem(last=False)
+    return text[:-2]
 
 
 async def execute_agent(
@@ -18,12 +139,13 @@ async def execute_agent(
     env: Optional[Dict[str, str]] = None,
     emit_events: bool = False,
     model: Optional[str] = None,
+    rendered_history: Optional[str] = None,
 ) -> Dict[str, Any]:
     """Execute a Claude agent with the Agent SDK.
 
     Args:
         task: Task with prompt, workspace
-        secrets: Secrets to inject as environment variables
+        secrets: Secrets to expose as environment variables of the agent process
         history: Conversation history [{"role": "user"|"assistant", "content": str}]
         system_prompt: System prompt for the agent
         allowed_tools: List of allowed tool names
@@ -31,6 +153,8 @@ async def execute_agent(
         env: Extra environment variables for agent
         emit_events: Emit events to event_store for SSE streaming
         model: Model override
+        rendered_history: History already rendered (ChatManager.get_rendered_history),
+            used instead of `history`
 
     Returns:
         Dict with success, output, tokens, session_id
@@ -48,26 +172,19 @@ async def execute_agent(
 
     os.environ['CLAUDE_AGENT_SDK_SKIP_VERSION_CHECK'] = '1'
 
-    # Inject secrets into environment
-    original_env = {}
-    if secrets:
-        for key, value in secrets.items():
-            original_env[key] = os.environ.get(key)
-            os.environ[key] = value
-
     try:
         # Build full prompt with history context
         full_prompt = task.prompt
-        if history:
-            context_parts = []
-            for msg in history:
-                role = "User" if msg["role"] == "user" else "Assistant"
-                context_parts.append(f"{role}: {msg['content']}")
-            conversation_context = "\n\n".join(context_parts)
+        if rendered_history:
+            conversation_context = rendered_history[:-2]
+            full_prompt = f"Previous conversation:\n\n{conversation_context}\n\nUser's new message: {task.prompt}"
+        elif history:
+            conversation_context = render_history(history, chat_id=task.chat_id)
             full_prompt = f"Previous conversation:\n\n{conversation_context}\n\nUser's new message: {task.prompt}"
 
-        # Build agent env
-        agent_env = dict(env or {})
+        # Build agent env: secrets and extras go to the agent process only,
+        # never into os.environ (agents may run concurrently in this process)
+        agent_env = {**(secrets or {}), **(env or {})}
 
         agent_model = model or os.environ.get('CLAUDE_MODEL', 'claude-sonnet-4-20250514')
 
@@ -87,54 +204,65 @@ async def execute_agent(
         if emit_events:
             event_store.add_event(task_id, 'start', {'model': agent_model})
 
-        response_text = ""
+        response_parts: List[str] = []
         input_tokens = 0
         output_tokens = 0
         tool_count = 0
         turn_count = 0
+        block_count = 0
+        session_id = None
+
+        # Blocks of one message are delivered to the event store together
+        async with _EventBatcher(task_id, enabled=emit_events) as batcher:
+            async for message in query(prompt=full_prompt, options=options):
+                if isinstance(message, ResultMessage):
+                    session_id = message.session_id
+                    if message.usage:
+                        input_tokens = message.usage.get('input_tokens', 0)
+                        output_tokens = message.usage.get('output_tokens', 0)
+                    continue
 
-        async for message in query(prompt=full_prompt, options=options):
-            if isinstance(message, ResultMessage):
-                if hasattr(message, 'usage') and message.usage:
-                    input_tokens = message.usage.get('input_tokens', 0)
-                    output_tokens = message.usage.get('output_tokens', 0)
-                continue
-
-            if isinstance(message, AssistantMessage):
-                turn_count += 1
-                has_text = False
-                tools_used = []
-
-                for block in message.content:
-                    if isinstance(block, TextBlock):
-                        response_text += block.text
-                        has_text = True
-
-                        # Emit text event for streaming
-                        if emit_events:
-                            event_store.add_event(task_id, 'text', {
+                if isinstance(message, AssistantMessage):
+                    turn_count += 1
+                    has_text = False
+                    tools_used = []
+
+                    for block in message.content:
+                        # Let SSE readers and other agents run during long messages
+                        block_count += 1
+                        if block_count % 8 == 0:
+                            await asyncio.sleep(0)
+
+                        if isinstance(block, TextBlock):
+                            response_parts.append(block.text)
+                            has_text = True
+
+                            # Emit text event for streaming
+                            await batcher.add('text', {
                                 'content': block.text,
                                 'turn': turn_count,
                             })
 
-                    elif isinstance(block, ToolUseBlock):
-                        tool_count += 1
-                        tool_name = block.name
-                        tool_input = getattr(block, 'input', {})
-                        tools_used.append({'name': tool_name, 'input': tool_input})
+                        elif isinstance(block, ToolUseBlock):
+                            tool_count += 1
+                            tool_name = block.name
+                            tool_input = block.input
+                            tools_used.append({'name': tool_name, 'input': tool_input})
 
-                        print(f"[task-{task_id}] Tool #{tool_count}: {tool_name}", flush=True)
+                            print(f"[task-{task_id}] Tool #{tool_count}: {tool_name}", flush=True)
 
-                        if emit_events:
-                            event_store.add_event(task_id, 'tool_use', {
+                            await batcher.add('tool_use', {
                                 'tool': tool_name,
                                 'count': tool_count,
                                 'input': tool_input,
                             })
 
-                # Emit thinking event if text without tools
-                if has_text and not tools_used and emit_events:
-                    event_store.add_event(task_id, 'thinking', {'turn': turn_count})
+                    # Emit thinking event if text without tools
+                    if has_text and not tools_used:
+                        await batcher.add('thinking', {'turn': turn_count})
+
+                    # Deliver this message's events before waiting for the next one
+                    await batcher.flush()
 
         print(f"[task-{task_id}] Completed: {tool_count} tools, {input_tokens} in / {output_tokens} out", flush=True)
 
@@ -147,10 +275,11 @@ async def execute_agent(
 
         return {
             'success': True,
-            'output': response_text,
+            'output': "".join(response_parts),
             'input_tokens': input_tokens,
             'output_tokens': output_tokens,
             'tool_count': tool_count,
+            'session_id': session_id,
         }
 
     except Exception as e:
@@ -158,16 +287,43 @@ async def execute_agent(
             event_store.add_event(task.id, 'error', {'error': str(e)})
         return {'success': False, 'error': str(e)}
 
-    finally:
-        # Restore original environment
-        if secrets:
-            for key, original_value in original_env.items():
-                if original_value is None:
-                    os.environ.pop(key, None)
-                else:
-                    os.environ[key] = original_value
+
+def run_agents_batch(
+    tasks: List[Task],
+    secrets_per_task: Optional[List[Optional[Dict[str, str]]]] = None,
+    max_concurrency: Optional[int] = None,
+    **kwargs,
+) -> List[Dict[str, Any]]:
+    """Run several agents concurrently in one event loop.
+
+    Args:
+        tasks: Agent tasks to run
+        secrets_per_task: Secrets for each task (same order as tasks)
+        max_concurrency: Max agents running at once (default AGENT_CONCURRENCY or 4)
+        **kwargs: Passed to every execute_agent call
+
+    Returns:
+        One execute_agent result per task, in order
+    """
+    if secrets_per_task is None:
+        secrets_per_task = [None] * len(tasks)
+    if max_concurrency is None:
+        max_concurrency = int(os.environ.get('AGENT_CONCURRENCY', '4'))
+
+    async def _gather():
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def _run(task, secrets):
+            async with semaphore:
+                return await execute_agent(task, secrets, **kwargs)
+
+        return await asyncio.gather(*(
+            _run(task, secrets) for task, secrets in zip(tasks, secrets_per_task)
+        ))
+
+    return asyncio.run(_gather())
 
 
 def run_agent(task: Task, secrets: Optional[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
     """Synchronous wrapper for execute_agent."""
-    return asyncio.run(execute_agent(task, secrets, **kwargs))
+    return run_agents_batch([task], [secrets], **kwargs)[0]
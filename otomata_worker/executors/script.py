@@ -1,59 +1,258 @@
 """Execute Python scripts as subprocess tasks."""
 
+import asyncio
 import subprocess
 import time
-import json
 import os
+import hashlib
+import marshal
+import multiprocessing
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Tuple, Dict, List
+from typing import NamedTuple, Optional, Tuple, Dict, List
+
+import orjson
 
 from ..secrets import secrets_service
 
 
-def execute_script(
-    script_path: Optional[str] = None,
-    script_content: Optional[str] = None,
-    params: Optional[Dict] = None,
-    timeout: int = 300,
-    env: Optional[Dict] = None,
-    workspace: Optional[str] = None,
-    required_secrets: Optional[List[str]] = None,
-    task_id: Optional[int] = None
-) -> Tuple[bool, str, Dict]:
-    """Execute a Python script with subprocess.
+# Compiled inline scripts, keyed by content hash (marshalled code objects)
+_COMPILE_CACHE_SIZE = 128
+_compiled_cache: OrderedDict[bytes, bytes] = OrderedDict()
+_compiled_lock = threading.Lock()
 
-    Args:
-        script_path: Path to script (absolute or relative to workspace)
-        script_content: Inline Python code to execute (alternative to script_path)
-        params: Parameters to pass as JSON to script stdin
-        timeout: Timeout in seconds
-        env: Environment variables to add
-        workspace: Working directory (defaults to cwd)
-        required_secrets: List of secret keys to inject from DB
-        task_id: Task ID for temp file naming
+
+def compile_cached(source: str) -> bytes:
+    """Compile inline script source once per distinct content.
 
     Returns:
-        Tuple of (success, output, metadata)
-        - success: True if script exited with code 0
-        - output: stdout on success, error message on failure
-        - metadata: dict with returncode, duration, stdout_length, stderr_length
+        Marshalled code object (the pool runs the worker's interpreter)
+
+    Raises:
+        SyntaxError: If the source does not compile (not cached)
+    """
+    data = source.encode()
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    with _compiled_lock:
+        code = _compiled_cache.get(digest)
+        if code is not None:
+            _compiled_cache.move_to_end(digest)
+            return code
+
+    code = marshal.dumps(compile(data, f"<script-{digest.hex()}>", 'exec'))
+    with _compiled_lock:
+        _compiled_cache[digest] = code
+        while len(_compiled_cache) > _COMPILE_CACHE_SIZE:
+            _compiled_cache.popitem(last=False)
+    return code
+
+
+def _run_in_child(
+    conn, script: str, input_data: Optional[bytes], env: Dict, cwd: str, pythonpath: str,
+    code: Optional[bytes] = None, source: Optional[str] = None,
+):
+    """Run a script in a forked pool child, as `python3 script` would, and send back the result.
+
+    Inline scripts come as `source`, plus a precompiled `code` object
+    unless it failed to compile (the child then reports the SyntaxError).
+    Like interpreter shutdown, non-daemon threads are joined and atexit
+    handlers run before the output is sent.
+    """
+    import atexit
+    import builtins
+    import linecache
+    import runpy
+    import sys
+    import tempfile
+    import traceback
+
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    sys.path[:0] = [os.path.dirname(script)] + pythonpath.split(os.pathsep)
+    sys.argv = [script]
+
+    stdin, stdout, stderr = (tempfile.TemporaryFile() for _ in range(3))
+    stdin.write(input_data or b'')
+    stdin.seek(0)
+    for f, fd in ((stdin, 0), (stdout, 1), (stderr, 2)):
+        os.dup2(f.fileno(), fd)
+    sys.stdin = open(0, closefd=False)
+    sys.stdout = open(1, 'w', closefd=False)
+    sys.stderr = open(2, 'w', closefd=False)
+
+    returncode = 0
+    try:
+        if source is not None:
+            code = marshal.loads(code) if code is not None else compile(source, script, 'exec')
+            # Tracebacks show source lines, as for a script file
+            linecache.cache[code.co_filename] = (len(source), None, source.splitlines(True), code.co_filename)
+            exec(code, {'__name__': '__main__', '__file__': script, '__builtins__': builtins})
+        else:
+            runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            returncode = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+
+    main_thread = threading.main_thread()
+    for thread in threading.enumerate():
+        if thread is not main_thread and not thread.daemon:
+            thread.join()
+    atexit._run_exitfuncs()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    stdout.seek(0)
+    stderr.seek(0)
+    conn.send((
+        returncode,
+        stdout.read().decode(errors='replace'),
+        stderr.read().decode(errors='replace'),
+    ))
+
+
+class ScriptWorkerPool:
+    """Run scripts in children forked from a pre-warmed forkserver.
+
+    The forkserver is a clean interpreter that imports `preload` modules
+    once; each job is a fork of it, so it skips interpreter startup and
+    those imports, and inherits no state (threads, DB connections) from
+    the worker. Scripts run with the worker's Python interpreter.
+    """
+
+    def __init__(self, preload: Optional[List[str]] = None):
+        self._ctx = multiprocessing.get_context('forkserver')
+        self._ctx.set_forkserver_preload([__name__] + list(preload or []))
+
+    def run(
+        self, script: str, input_data: Optional[bytes], env: Dict, cwd: str, pythonpath: str, timeout: int,
+        code: Optional[bytes] = None, source: Optional[str] = None,
+    ):
+        """Run a script; returns (returncode, stdout, stderr).
+
+        `script` is only used as `__file__`/argv when `source` is given.
+
+        Raises:
+            subprocess.TimeoutExpired: If the script runs longer than timeout
+        """
+        parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(
+            target=_run_in_child,
+            args=(child_conn, script, input_data, env, cwd, pythonpath, code, source),
+        )
+        proc.start()
+        child_conn.close()
+        try:
+            if not parent_conn.poll(timeout):
+                raise subprocess.TimeoutExpired(script, timeout)
+            return parent_conn.recv()
+        except EOFError:
+            # Child died without reporting (e.g. killed, os._exit)
+            proc.join()
+            return proc.exitcode, '', ''
+        finally:
+            if proc.is_alive():
+                proc.kill()
+            proc.join()
+            parent_conn.close()
+
+
+@contextmanager
+def _script_file(path: Path, content: Optional[str], task_id: Optional[int]):
+    """Yield (script path, fds to pass) for the subprocess.
+
+    Inline content lives in an anonymous memfd (Linux), else in a file
+    under /dev/shm or /tmp that is removed on exit.
+    """
+    if content is None:
+        yield str(path), ()
+        return
+
+    name = f"otomata_task_{task_id or 'unknown'}"
+    data = content.encode()
+    if hasattr(os, 'memfd_create'):
+        try:
+            fd = os.memfd_create(name)
+        except OSError:
+            pass
+        else:
+            try:
+                with open(fd, 'wb', closefd=False) as f:
+                    f.write(data)
+                yield f"/proc/self/fd/{fd}", (fd,)
+            finally:
+                os.close(fd)
+            return
+
+    tmp_dir = Path('/dev/shm') if os.access('/dev/shm', os.W_OK) else Path('/tmp')
+    tmp_path = tmp_dir / f"{name}.py"
+    tmp_path.write_bytes(data)
+    try:
+        yield str(tmp_path), ()
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+_pool: Optional[ScriptWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_script_pool() -> Optional[ScriptWorkerPool]:
+    """Shared pool if SCRIPT_POOL is enabled, else None."""
+    global _pool
+    if os.environ.get('SCRIPT_POOL', '').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            preload = [m for m in os.environ.get('SCRIPT_POOL_PRELOAD', '').split(',') if m]
+            _pool = ScriptWorkerPool(preload)
+        return _pool
+
+
+class _PreparedScript(NamedTuple):
+    full_path: Path
+    script_content: Optional[str]
+    python_cmd: str
+    exec_env: Dict
+    workspace_path: Path
+    pythonpath: str
+    task_id: Optional[int]
+
+
+def _prepare_script(
+    script_path: Optional[str],
+    script_content: Optional[str],
+    env: Optional[Dict],
+    workspace: Optional[str],
+    required_secrets: Optional[List[str]],
+    task_id: Optional[int],
+):
+    """Resolve the script, interpreter and environment of a run.
+
+    Returns:
+        _PreparedScript, or an error message if there is nothing to run
     """
     workspace_path = Path(workspace) if workspace else Path.cwd()
-    tmp_script_path = None
 
     if script_content:
-        # Write inline script to temp file
-        tmp_script_path = Path(f"/tmp/otomata_task_{task_id or 'unknown'}.py")
-        tmp_script_path.write_text(script_content)
-        full_path = tmp_script_path
+        # Inline script: only materialized (in memory) if run as a subprocess
+        full_path = Path(f"/tmp/otomata_task_{task_id or 'unknown'}.py")
     elif script_path:
         full_path = Path(script_path)
         if not full_path.is_absolute():
             full_path = workspace_path / script_path
         if not full_path.exists():
-            return False, f"Script not found: {script_path}", {}
+            return f"Script not found: {script_path}"
     else:
-        return False, "No script_path or script_content provided", {}
+        return "No script_path or script_content provided"
 
     # Build command - use venv python if available
     venv_python = workspace_path / 'venv' / 'bin' / 'python3'
@@ -65,8 +264,6 @@ def execute_script(
     else:
         python_cmd = 'python3'
 
-    cmd = [python_cmd, str(full_path)]
-
     # Prepare minimal environment
     exec_env = {
         'PATH': os.environ.get('PATH', '/usr/bin:/bin'),
@@ -95,44 +292,182 @@ def execute_script(
     if env:
         exec_env.update(env)
 
+    return _PreparedScript(
+        full_path, script_content or None, python_cmd, exec_env, workspace_path, pythonpath, task_id
+    )
+
+
+def _encode_params(params: Optional[Dict]) -> Optional[bytes]:
+    """Params as the UTF-8 JSON passed to the script's stdin (encoded once)."""
+    return orjson.dumps(params, option=orjson.OPT_NON_STR_KEYS) if params else None
+
+
+def _decode_output(data: bytes) -> str:
+    return data.decode(errors='replace')
+
+
+def _pool_for(prepared: _PreparedScript) -> Optional[ScriptWorkerPool]:
+    """Pre-warmed pool (opt-in) only when the script would run with the
+    default interpreter anyway; workspace venvs keep a subprocess."""
+    return get_script_pool() if prepared.python_cmd == 'python3' else None
+
+
+def _run_in_pool(pool: ScriptWorkerPool, prepared: _PreparedScript, input_data: Optional[bytes], timeout: int):
+    code = None
+    if prepared.script_content:
+        try:
+            code = compile_cached(prepared.script_content)
+        except SyntaxError:
+            pass  # Compiled (and reported) by the child
+    return pool.run(
+        str(prepared.full_path), input_data, prepared.exec_env, str(prepared.workspace_path),
+        prepared.pythonpath, timeout, code=code, source=prepared.script_content,
+    )
+
+
+def _script_result(returncode: int, stdout: str, stderr: str, t0: float) -> Tuple[bool, str, Dict]:
+    duration = time.time() - t0
+
+    metadata = {
+        'returncode': returncode,
+        'duration': duration,
+        'stdout_length': len(stdout),
+        'stderr_length': len(stderr)
+    }
+
+    if returncode == 0:
+        return True, stdout, metadata
+    else:
+        error_msg = f"Script exited with code {returncode}\nSTDERR:\n{stderr}"
+        return False, error_msg, metadata
+
+
+def _timeout_result(timeout: int, t0: float) -> Tuple[bool, str, Dict]:
+    duration = time.time() - t0
+    return False, f"Script timeout after {timeout}s", {'duration': duration, 'timeout': True}
+
+
+def _error_result(e: Exception, t0: float) -> Tuple[bool, str, Dict]:
+    duration = time.time() - t0
+    return False, f"Script execution error: {e}", {'duration': duration, 'error': str(e)}
+
+
+def execute_script(
+    script_path: Optional[str] = None,
+    script_content: Optional[str] = None,
+    params: Optional[Dict] = None,
+    timeout: int = 300,
+    env: Optional[Dict] = None,
+    workspace: Optional[str] = None,
+    required_secrets: Optional[List[str]] = None,
+    task_id: Optional[int] = None
+) -> Tuple[bool, str, Dict]:
+    """Execute a Python script with subprocess.
+
+    Args:
+        script_path: Path to script (absolute or relative to workspace)
+        script_content: Inline Python code to execute (alternative to script_path)
+        params: Parameters to pass as JSON to script stdin
+        timeout: Timeout in seconds
+        env: Environment variables to add
+        workspace: Working directory (defaults to cwd)
+        required_secrets: List of secret keys to inject from DB
+        task_id: Task ID for temp file naming
+
+    Returns:
+        Tuple of (success, output, metadata)
+        - success: True if script exited with code 0
+        - output: stdout on success, error message on failure
+        - metadata: dict with returncode, duration, stdout_length, stderr_length
+    """
+    prepared = _prepare_script(script_path, script_content, env, workspace, required_secrets, task_id)
+    if isinstance(prepared, str):
+        return False, prepared, {}
+
     t0 = time.time()
 
     try:
         # Pass params as JSON to stdin
-        input_data = json.dumps(params) if params else None
-
-        result = subprocess.run(
-            cmd,
-            input=input_data,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-            env=exec_env,
-            cwd=str(workspace_path)
-        )
+        input_data = _encode_params(params)
+
+        pool = _pool_for(prepared)
+        if pool is not None:
+            returncode, stdout, stderr = _run_in_pool(pool, prepared, input_data, timeout)
+        else:
+            with _script_file(prepared.full_path, prepared.script_content, task_id) as (script_file, pass_fds):
+                result = subprocess.run(
+                    [prepared.python_cmd, script_file],
+                    input=input_data,
+                    capture_output=True,
+                    timeout=timeout,
+                    env=prepared.exec_env,
+                    cwd=str(prepared.workspace_path),
+                    pass_fds=pass_fds,
+                )
+            returncode, stdout, stderr = result.returncode, _decode_output(result.stdout), _decode_output(result.stderr)
+
+        return _script_result(returncode, stdout, stderr, t0)
+
+    except subprocess.TimeoutExpired:
+        return _timeout_result(timeout, t0)
+    except Exception as e:
+        return _error_result(e, t0)
+
+
+async def execute_script_async(
+    script_path: Optional[str] = None,
+    script_content: Optional[str] = None,
+    params: Optional[Dict] = None,
+    timeout: int = 300,
+    env: Optional[Dict] = None,
+    workspace: Optional[str] = None,
+    required_secrets: Optional[List[str]] = None,
+    task_id: Optional[int] = None
+) -> Tuple[bool, str, Dict]:
+    """Async variant of execute_script: waits for the script without blocking the event loop.
 
-        duration = time.time() - t0
+    Same arguments and return value as execute_script.
+    """
+    prepared = await asyncio.to_thread(
+        _prepare_script, script_path, script_content, env, workspace, required_secrets, task_id
+    )
+    if isinstance(prepared, str):
+        return False, prepared, {}
 
-        metadata = {
-            'returncode': result.returncode,
-            'duration': duration,
-            'stdout_length': len(result.stdout),
-            'stderr_length': len(result.stderr)
-        }
+    t0 = time.time()
 
-        if result.returncode == 0:
-            return True, result.stdout, metadata
+    try:
+        input_data = _encode_params(params)
+
+        pool = _pool_for(prepared)
+        if pool is not None:
+            returncode, stdout, stderr = await asyncio.to_thread(
+                _run_in_pool, pool, prepared, input_data, timeout
+            )
         else:
-            error_msg = f"Script exited with code {result.returncode}\nSTDERR:\n{result.stderr}"
-            return False, error_msg, metadata
+            with _script_file(prepared.full_path, prepared.script_content, task_id) as (script_file, pass_fds):
+                proc = await asyncio.create_subprocess_exec(
+                    prepared.python_cmd, script_file,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=prepared.exec_env,
+                    cwd=str(prepared.workspace_path),
+                    pass_fds=pass_fds,
+                )
+                try:
+                    out, err = await asyncio.wait_for(
+                        proc.communicate(input_data), timeout
+                    )
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+                    raise subprocess.TimeoutExpired(script_file, timeout)
+            returncode, stdout, stderr = proc.returncode, _decode_output(out), _decode_output(err)
+
+        return _script_result(returncode, stdout, stderr, t0)
 
     except subprocess.TimeoutExpired:
-        duration = time.time() - t0
-        return False, f"Script timeout after {timeout}s", {'duration': duration, 'timeout': True}
+        return _timeout_result(timeout, t0)
     except Exception as e:
-        duration = time.time() - t0
-        return False, f"Script execution error: {e}", {'duration': duration, 'error': str(e)}
-    finally:
-        # Cleanup temp script file
-        if tmp_script_path and tmp_script_path.exists():
-            tmp_script_path.unlink()
+        return _error_result(e, t0)
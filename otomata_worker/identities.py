@@ -3,126 +3,157 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import func
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
 
+from .cache import TTLCache
 from .models import Identity, RateLimit
 from .database import get_session
 from .secrets import secrets_service
 
 
+# Columns returned by get_by_id / get_by_name (no credentials)
+_IDENTITY_COLUMNS = (
+    Identity.id, Identity.platform, Identity.name, Identity.account_type,
+    Identity.status, Identity.user_agent, Identity.last_used_at,
+    Identity.blocked_at, Identity.blocked_reason, Identity.created_at,
+)
+
+# Columns returned by list_all
+_LIST_COLUMNS = (
+    Identity.id, Identity.platform, Identity.name, Identity.account_type,
+    Identity.status, Identity.last_used_at, Identity.blocked_at, Identity.blocked_reason,
+)
+
+
+# Decrypted cookies by identity ID. Invalidated by this process's writes;
+# changes made by other processes show up within the TTL.
+_cookie_cache = TTLCache(maxsize=256, ttl=300)
+
+
+def _to_dict(row) -> Optional[dict]:
+    """Convert an identity row mapping to a dict (None passes through)."""
+    return dict(row) if row is not None else None
+
+
 class IdentityManager:
     """Manage platform identities with rate limit awareness."""
 
-    def get_available(self, platform: str, action_type: Optional[str] = None) -> Optional[int]:
+    def get_available(
+        self,
+        platform: str,
+        action_type: Optional[str] = None,
+        session: Optional[Session] = None,
+    ) -> Optional[int]:
         """Get least-used active identity ID that can make requests.
 
         Args:
             platform: Platform name (linkedin, kaspr)
             action_type: Optional action to check rate limits for
+            session: Optional session to run in (caller commits)
 
         Returns:
             Identity ID with lowest recent usage, or None if all exhausted
         """
-        with get_session() as session:
-            # Get active identities ordered by last_used_at (oldest first)
-            identities = session.query(Identity).filter(
-                Identity.platform == platform,
-                Identity.status == 'active'
-            ).order_by(
-                Identity.last_used_at.asc().nullsfirst()
-            ).all()
-
-            if not identities:
-                return None
-
-            if not action_type:
-                return identities[0].id
-
-            # Check rate limits for each
-            from .rate_limiter import DBRateLimiter
-            rate_limiter = DBRateLimiter()
-
-            for identity in identities:
-                can_request, _ = rate_limiter.can_request(identity.id, action_type)
-                if can_request:
-                    return identity.id
-
-            return None
+        # Active identities, oldest last_used_at first
+        query = select(Identity.id).where(
+            Identity.platform == platform,
+            Identity.status == 'active'
+        )
+
+        query = query.order_by(Identity.last_used_at.asc().nullsfirst(), Identity.id)
+        if not action_type:
+            with get_session(session) as session:
+                return session.execute(query.limit(1)).scalar()
+
+        from .rate_limiter import DBRateLimiter
+        rate_limiter = DBRateLimiter()
+
+        if rate_limiter.redis is not None:
+            # Counters are in Redis: candidates in order, then one pipelined check
+            with get_session(session) as session:
+                identity_ids = list(session.execute(query).scalars())
+            return rate_limiter.first_available(identity_ids, action_type)
+
+        # Rate limits are checked in the same query (one round-trip)
+        query = query.outerjoin(
+            RateLimit, rate_limiter.join_condition(action_type)
+        ).where(rate_limiter.within_limits(action_type))
+
+        with get_session(session) as session:
+            return session.execute(query.limit(1)).scalar()
 
     def get_by_name(self, platform: str, name: str) -> Optional[dict]:
         """Get identity by platform and name."""
         with get_session() as session:
-            identity = session.query(Identity).filter(
-                Identity.platform == platform,
-                Identity.name == name
-            ).first()
-            if identity:
-                return self._to_dict(identity)
-            return None
-
-    def get_by_id(self, identity_id: int) -> Optional[dict]:
+            return _to_dict(session.execute(
+                select(*_IDENTITY_COLUMNS).where(
+                    Identity.platform == platform,
+                    Identity.name == name
+                ).limit(1)
+            ).mappings().first())
+
+    def get_by_id(self, identity_id: int, session: Optional[Session] = None) -> Optional[dict]:
         """Get identity by ID."""
-        with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity:
-                return self._to_dict(identity)
-            return None
-
-    def _to_dict(self, identity: Identity) -> dict:
-        """Convert identity to dict."""
-        return {
-            'id': identity.id,
-            'platform': identity.platform,
-            'name': identity.name,
-            'account_type': identity.account_type,
-            'status': identity.status,
-            'user_agent': identity.user_agent,
-            'last_used_at': identity.last_used_at,
-            'blocked_at': identity.blocked_at,
-            'blocked_reason': identity.blocked_reason,
-            'created_at': identity.created_at,
-        }
-
-    def mark_used(self, identity_id: int):
+        with get_session(session) as session:
+            return _to_dict(session.execute(
+                select(*_IDENTITY_COLUMNS).where(Identity.id == identity_id)
+            ).mappings().first())
+
+    def _update(self, identity_id: int, session: Optional[Session] = None, **values) -> bool:
+        """UPDATE one identity without loading it. Returns True if it exists."""
+        with get_session(session) as session:
+            return session.execute(
+                update(Identity).where(Identity.id == identity_id).values(**values)
+            ).rowcount > 0
+
+    def mark_used(self, identity_id: int, session: Optional[Session] = None):
         """Update last_used_at timestamp."""
+        self._update(identity_id, session=session, last_used_at=datetime.utcnow())
+
+    def bulk_mark_used(self, identity_ids: list[int]) -> int:
+        """Update last_used_at of several identities in one UPDATE.
+
+        Returns:
+            Number of identities updated
+        """
+        if not identity_ids:
+            return 0
         with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity:
-                identity.last_used_at = datetime.utcnow()
+            return session.execute(
+                update(Identity).where(Identity.id.in_(identity_ids)).values(last_used_at=datetime.utcnow())
+            ).rowcount
 
     def mark_blocked(self, identity_id: int, reason: str):
         """Mark identity as blocked."""
-        with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity:
-                identity.status = 'blocked'
-                identity.blocked_at = datetime.utcnow()
-                identity.blocked_reason = reason
+        self._update(identity_id, status='blocked', blocked_at=datetime.utcnow(), blocked_reason=reason)
+        _cookie_cache.pop(identity_id)
 
     def mark_active(self, identity_id: int):
         """Mark identity as active (unblock)."""
-        with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity:
-                identity.status = 'active'
-                identity.blocked_at = None
-                identity.blocked_reason = None
-
-    def get_cookie(self, identity_id: int) -> Optional[str]:
-        """Get decrypted cookie for identity."""
-        with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity and identity.cookie_encrypted:
-                return secrets_service.decrypt(identity.cookie_encrypted)
+        self._update(identity_id, status='active', blocked_at=None, blocked_reason=None)
+
+    def get_cookie(self, identity_id: int, session: Optional[Session] = None) -> Optional[str]:
+        """Get decrypted cookie for identity (cached for 5 minutes)."""
+        cookie = _cookie_cache.get(identity_id)
+        if cookie is not None:
+            return cookie
+
+        with get_session(session) as session:
+            encrypted = session.execute(
+                select(Identity.cookie_encrypted).where(Identity.id == identity_id)
+            ).scalar()
+        if not encrypted:
             return None
 
+        cookie = secrets_service.decrypt(encrypted)
+        _cookie_cache.set(identity_id, cookie)
+        return cookie
+
     def set_cookie(self, identity_id: int, cookie: str):
         """Set encrypted cookie for identity."""
-        encrypted = secrets_service.encrypt(cookie)
-        with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity:
-                identity.cookie_encrypted = encrypted
+        self._update(identity_id, cookie_encrypted=secrets_service.encrypt(cookie))
+        _cookie_cache.pop(identity_id)
 
     def create(
         self,
@@ -151,36 +182,30 @@ class IdentityManager:
 
     def list_all(self, platform: Optional[str] = None, status: Optional[str] = None) -> list[dict]:
         """List identities with stats."""
+        query = select(*_LIST_COLUMNS)
+        if platform:
+            query = query.where(Identity.platform == platform)
+        if status:
+            query = query.where(Identity.status == status)
+        query = query.order_by(Identity.platform, Identity.name)
+
         with get_session() as session:
-            query = session.query(Identity)
-
-            if platform:
-                query = query.filter(Identity.platform == platform)
-            if status:
-                query = query.filter(Identity.status == status)
-
-            identities = query.order_by(Identity.platform, Identity.name).all()
-
-            return [
-                {
-                    'id': i.id,
-                    'platform': i.platform,
-                    'name': i.name,
-                    'account_type': i.account_type,
-                    'status': i.status,
-                    'last_used_at': i.last_used_at.isoformat() if i.last_used_at else None,
-                    'blocked_at': i.blocked_at.isoformat() if i.blocked_at else None,
-                    'blocked_reason': i.blocked_reason,
-                }
-                for i in identities
-            ]
+            identities = [dict(row) for row in session.execute(query).mappings()]
+
+        for i in identities:
+            for key in ('last_used_at', 'blocked_at'):
+                if i[key]:
+                    i[key] = i[key].isoformat()
+        return identities
 
     def delete(self, identity_id: int) -> bool:
         """Delete an identity."""
+        _cookie_cache.pop(identity_id)
         with get_session() as session:
-            identity = session.query(Identity).get(identity_id)
-            if identity:
-                session.delete(identity)
-                session.commit()
-                return True
-            return False
+            # Keep rate limit history, detached (as the ORM cascade did)
+            session.execute(
+                update(RateLimit).where(RateLimit.identity_id == identity_id).values(identity_id=None)
+            )
+            return session.execute(
+                delete(Identity).where(Identity.id == identity_id)
+            ).rowcount > 0
@@ -4,11 +4,13 @@ import os
 from datetime import datetime
 from enum import Enum
 
+import orjson
 from sqlalchemy import (
-    Column, Integer, String, Text, DateTime, Date, JSON, ForeignKey,
-    Enum as SQLEnum, create_engine
+    DDL, Column, Integer, String, Text, DateTime, Date, JSON, ForeignKey, Index,
+    Enum as SQLEnum, create_engine, event, make_url, text
 )
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declarative_base, deferred, relationship
 
 Base = declarative_base()
 
@@ -28,14 +30,25 @@ class MessageRole(str, Enum):
 class Chat(Base):
     """Chat session with system prompt and config."""
     __tablename__ = 'chats'
+    __table_args__ = (
+        Index('ix_chats_metadata_gin', 'metadata', postgresql_using='gin'),
+    )
 
     id = Column(Integer, primary_key=True)
     tenant = Column(String(100), index=True)
-    metadata_ = Column('metadata', JSON)
+    metadata_ = Column('metadata', JSONB)
     system_prompt = Column(Text)
     workspace = Column(String(255))
     allowed_tools = Column(JSON)
     max_turns = Column(Integer, default=50)
+    # Message stats, maintained by ChatManager.add_messages
+    message_count = Column(Integer, default=0, server_default='0', nullable=False)
+    max_sequence = Column(Integer, default=0, server_default='0', nullable=False)
+    last_message_at = Column(DateTime)
+    # All messages rendered as agent context, appended by add_messages
+    # (NULL for chats created before it existed: rendered from messages).
+    # Deferred: only read through ChatManager.get_rendered_history
+    rendered_history = deferred(Column(Text))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -50,6 +63,9 @@ class Chat(Base):
 class Message(Base):
     """Chat message."""
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_chat_sequence', 'chat_id', 'sequence', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     chat_id = Column(Integer, ForeignKey('chats.id'), index=True)
@@ -72,11 +88,23 @@ class Message(Base):
 class TaskEvent(Base):
     """Event emitted during task execution."""
     __tablename__ = 'task_events'
+    __table_args__ = (
+        Index('ix_task_events_task_sequence', 'task_id', 'sequence', unique=True),
+        # Text/tool_use events per task in time order (list_messages include_tools).
+        # No INCLUDE of payload columns: they can exceed the btree row size limit.
+        Index(
+            'ix_task_events_task_created', 'task_id', 'created_at',
+            postgresql_where=text("event_type IN ('text', 'tool_use')"),
+        ),
+        # Append-only, so created_at follows physical order: tiny BRIN for age purges
+        Index('ix_task_events_created_brin', 'created_at', postgresql_using='brin'),
+    )
 
     id = Column(Integer, primary_key=True)
     task_id = Column(Integer, ForeignKey('tasks.id'), index=True)
     event_type = Column(String(50))
     event_data = Column(JSON)
+    display_summary = Column(Text)  # One-line tool_use description, set at write time
     sequence = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -90,6 +118,12 @@ class TaskEvent(Base):
 class Task(Base):
     """Task model - simplified job execution."""
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # claim: oldest pending first, index only as large as the queue
+        Index('ix_tasks_pending_created', 'created_at', postgresql_where=text("status = 'pending'")),
+        # release / per-worker views: only running rows carry a live claim
+        Index('ix_tasks_running_worker', 'claimed_by', postgresql_where=text("status = 'running'")),
+    )
 
     id = Column(Integer, primary_key=True)
     status = Column(
@@ -112,7 +146,8 @@ class Task(Base):
     chat_id = Column(Integer, ForeignKey('chats.id'), nullable=True, index=True)
 
     # Execution
-    claimed_by = Column(String(100), index=True)  # worker-{hostname}
+    claimed_by = Column(String(100))  # worker-{hostname}
+    claimed_until = Column(DateTime)  # Lease on a claim queued by the worker, cleared at start
     started_at = Column(DateTime)
     completed_at = Column(DateTime)
     error = Column(Text)
@@ -128,12 +163,41 @@ class Task(Base):
         return f"<Task {self.id} type={self.task_type} status={self.status}>"
 
 
+# Idle workers LISTEN on this channel: a task became claimable (new, retried
+# or released). Notifications are sent on commit, one per transaction.
+TASK_NOTIFY_CHANNEL = 'task_pending'
+
+TASK_NOTIFY_DDL = (
+    DDL(f"""
+        CREATE OR REPLACE FUNCTION notify_task_pending() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{TASK_NOTIFY_CHANNEL}', '');
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+    """),
+    DDL("DROP TRIGGER IF EXISTS task_notify ON tasks"),
+    DDL("""
+        CREATE TRIGGER task_notify AFTER INSERT OR UPDATE OF status ON tasks
+        FOR EACH ROW WHEN (NEW.status = 'pending') EXECUTE FUNCTION notify_task_pending()
+    """),
+)
+for _ddl in TASK_NOTIFY_DDL:
+    event.listen(Task.__table__, 'after_create', _ddl.execute_if(dialect='postgresql'))
+
+
 class Identity(Base):
     """Platform identity (LinkedIn, Kaspr, etc.)."""
     __tablename__ = 'identities'
+    __table_args__ = (
+        # get_available: filter platform/status, oldest last_used_at first (index-only)
+        Index(
+            'ix_identity_platform_status_lastused', 'platform', 'status', 'last_used_at',
+            postgresql_include=['id'],
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
-    platform = Column(String(50), index=True)  # linkedin, kaspr
+    platform = Column(String(50))  # linkedin, kaspr
     name = Column(String(100))  # marie.dupont
     account_type = Column(String(20))  # free, premium
 
@@ -150,7 +214,7 @@ class Identity(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
-    rate_limits = relationship("RateLimit", back_populates="identity")
+    rate_limits = relationship("RateLimit", back_populates="identity", lazy="raise_on_sql")
 
     def __repr__(self):
         return f"<Identity {self.platform}/{self.name} status={self.status}>"
@@ -159,18 +223,25 @@ class Identity(Base):
 class RateLimit(Base):
     """DB-backed rate limits per identity/action."""
     __tablename__ = 'rate_limits'
+    __table_args__ = (
+        # One record per identity/action/day
+        Index('ix_ratelimit_identity_action_date', 'identity_id', 'action_type', 'date', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     identity_id = Column(Integer, ForeignKey('identities.id'), index=True)
     action_type = Column(String(50))  # profile_visit, search
 
     date = Column(Date, index=True)
-    hourly_timestamps = Column(JSON, default=list)  # Timestamps last hour
+    # Sliding window counter: requests in the current clock hour and the one before
+    hourly_window_start = Column(DateTime)
+    hourly_current_count = Column(Integer, default=0, server_default='0', nullable=False)
+    hourly_previous_count = Column(Integer, default=0, server_default='0', nullable=False)
     daily_count = Column(Integer, default=0)
     last_request_at = Column(DateTime)
 
     # Relationships
-    identity = relationship("Identity", back_populates="rate_limits")
+    identity = relationship("Identity", back_populates="rate_limits", lazy="raise_on_sql")
 
     def __repr__(self):
         return f"<RateLimit identity={self.identity_id} action={self.action_type} daily={self.daily_count}>"
@@ -184,9 +255,13 @@ class SecretScope(str, Enum):
 class Secret(Base):
     """Encrypted secrets storage."""
     __tablename__ = 'secrets'
+    __table_args__ = (
+        # One secret per key/scope/owner (platform secrets have no user_id)
+        Index('ix_secret_lookup', 'key', 'scope', text('coalesce(user_id, 0)'), unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
-    key = Column(String(100), index=True)
+    key = Column(String(100))
     scope = Column(
         SQLEnum(SecretScope, values_callable=lambda x: [e.value for e in x], create_constraint=False, native_enum=True, name='secretscope'),
         default=SecretScope.PLATFORM
@@ -204,11 +279,43 @@ class Secret(Base):
 
 
 def get_engine():
-    """Get SQLAlchemy engine from DATABASE_URL."""
+    """Get SQLAlchemy engine from DATABASE_URL.
+
+    The pool is sized for the API server and worker loop sharing one
+    engine (DB_POOL_SIZE / DB_MAX_OVERFLOW, 25 each by default). Checkout
+    fails after 10s instead of queueing indefinitely when saturated.
+    Connections are reused LIFO so idle extras age out via pool_recycle.
+    On PostgreSQL, DB_STATEMENT_TIMEOUT (ms) caps every statement so a
+    stuck query frees its connection instead of pinning the pool.
+    JSON columns are encoded and decoded with orjson. With psycopg2,
+    executemany UPDATE/DELETE statements are sent in batches too.
+    """
     database_url = os.environ.get('DATABASE_URL')
     if not database_url:
         raise ValueError("DATABASE_URL not set")
-    return create_engine(database_url)
+    url = make_url(database_url)
+    driver_options = {}
+    if url.get_driver_name() == 'psycopg2':
+        driver_options['executemany_mode'] = 'values_plus_batch'
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT', '0'))
+    if statement_timeout and url.get_backend_name() == 'postgresql':
+        driver_options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return create_engine(
+        database_url,
+        pool_size=int(os.environ.get('DB_POOL_SIZE', '25')),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', '25')),
+        pool_timeout=10,
+        pool_recycle=1800,
+        pool_pre_ping=True,
+        pool_use_lifo=True,
+        json_serializer=_json_dumps,
+        json_deserializer=orjson.loads,
+        **driver_options,
+    )
+
+
+def _json_dumps(value) -> str:
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
 
 
 def init_db(engine=None):
@@ -1,9 +1,16 @@
 """DB-backed rate limiter for distributed workers."""
 
+import math
+import os
+import time
+import uuid
 from datetime import datetime, date, timedelta
 from typing import Tuple, Optional
 
-from .models import RateLimit
+from sqlalchemy import and_, bindparam, case, delete, func, lambda_stmt, or_, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import Identity, RateLimit
 from .database import get_session
 
 
@@ -21,44 +28,186 @@ DEFAULT_LIMITS = {
 }
 
 
+# Today's counters of one identity/action, compiled once
+_counters_stmt = lambda_stmt(lambda: select(
+    RateLimit.daily_count,
+    RateLimit.hourly_window_start,
+    RateLimit.hourly_current_count,
+    RateLimit.hourly_previous_count,
+).where(
+    RateLimit.identity_id == bindparam('identity_id'),
+    RateLimit.action_type == bindparam('action_type'),
+    RateLimit.date == bindparam('date'),
+))
+
+
+# Atomic check-and-record for the Redis backend. Returns {1, 0} when the
+# request is recorded, {0, wait_seconds} when rejected (-1: daily cap).
+_CONSUME_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - 3600)
+if tonumber(redis.call('GET', KEYS[2]) or '0') >= tonumber(ARGV[4]) then
+    return {0, -1}
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, math.max(0, math.ceil(tonumber(oldest[2]) + 3600 - now))}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[2])
+redis.call('EXPIRE', KEYS[1], 3600)
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], 86400)
+return {1, 0}
+"""
+
+
+_redis_client = None
+
+
+def get_redis_client():
+    """Shared Redis client from REDIS_URL, or None when it is not set."""
+    global _redis_client
+    url = os.environ.get('REDIS_URL')
+    if not url:
+        return None
+    if _redis_client is None:
+        try:
+            import redis
+        except ImportError:
+            raise ImportError(
+                "REDIS_URL is set but redis is not installed. Install with: pip install otomata-worker[redis]"
+            )
+        _redis_client = redis.Redis.from_url(url)
+    return _redis_client
+
+
+def _hourly_window(now: float) -> Tuple[datetime, float]:
+    """Start of the current clock hour (naive UTC) and the weight of the previous one.
+
+    The previous hour counts for the share of it still inside the sliding
+    one-hour window: 1 at the top of the hour, 0 at its end.
+    """
+    start = int(now) // 3600 * 3600
+    return datetime.utcfromtimestamp(start), 1 - (now - start) / 3600
+
+
+def _seconds_until_midnight() -> int:
+    now = datetime.utcnow()
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    return int((tomorrow - now).total_seconds())
+
+
 class DBRateLimiter:
-    """Database-backed rate limiter with hourly and daily limits."""
+    """Database-backed rate limiter with hourly and daily limits.
 
-    def __init__(self, limits: Optional[dict] = None):
+    The hourly limit is a sliding window counter: each record keeps the
+    request counts of the current and previous clock hours, and the last
+    hour is estimated as `previous * weight + current` (see `_hourly_window`).
+
+    With a Redis client (argument or REDIS_URL), counters live in Redis
+    instead: a sorted set of request times per identity/action for the
+    hourly window (`rl:{identity}:{action}`) and a daily counter
+    (`rl:daily:{identity}:{action}:{date}`). Each check or record is one
+    pipelined round-trip, and timestamps never leave Redis.
+    """
+
+    def __init__(self, limits: Optional[dict] = None, redis_client=None):
         """Initialize with custom limits or use defaults."""
         self.limits = limits or DEFAULT_LIMITS
+        self.redis = redis_client if redis_client is not None else get_redis_client()
+        self._consume_script = None
 
     def _get_limits(self, action_type: str) -> dict:
         """Get limits for action type."""
         return self.limits.get(action_type, self.limits['default'])
 
-    def _get_or_create_record(self, session, identity_id: int, action_type: str) -> RateLimit:
-        """Get or create rate limit record for today."""
-        today = date.today()
-
-        record = session.query(RateLimit).filter(
-            RateLimit.identity_id == identity_id,
+    def join_condition(self, action_type: str):
+        """ON clause matching an identity to today's record for `action_type`."""
+        return and_(
+            RateLimit.identity_id == Identity.id,
             RateLimit.action_type == action_type,
-            RateLimit.date == today
-        ).first()
-
-        if not record:
-            record = RateLimit(
-                identity_id=identity_id,
-                action_type=action_type,
-                date=today,
-                hourly_timestamps=[],
-                daily_count=0
-            )
-            session.add(record)
-            session.flush()
+            RateLimit.date == date.today(),
+        )
 
-        return record
+    def within_limits(self, action_type: str):
+        """SQL predicate equivalent to `can_request` for rows joined with `join_condition`.
 
-    def _prune_hourly_timestamps(self, timestamps: list) -> list:
-        """Remove timestamps older than 1 hour."""
-        one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-        return [ts for ts in timestamps if datetime.fromisoformat(ts) > one_hour_ago]
+        True when the identity has no record yet today, or is under both the
+        daily cap and the number of requests allowed in the last hour.
+        """
+        return or_(RateLimit.id.is_(None), self._under_limits(self._get_limits(action_type)))
+
+    @staticmethod
+    def _under_limits(limits: dict):
+        """SQL predicate: an existing record is under both the daily and hourly limits."""
+        window_start, weight = _hourly_window(time.time())
+        hourly_estimate = case(
+            (
+                RateLimit.hourly_window_start == window_start,
+                RateLimit.hourly_previous_count * weight + RateLimit.hourly_current_count,
+            ),
+            (
+                RateLimit.hourly_window_start == window_start - timedelta(hours=1),
+                RateLimit.hourly_current_count * weight,
+            ),
+            else_=0,
+        )
+        return and_(
+            func.coalesce(RateLimit.daily_count, 0) < limits['daily'],
+            hourly_estimate < limits['hourly'],
+        )
+
+    @staticmethod
+    def _hourly_key(identity_id: int, action_type: str) -> str:
+        return f"rl:{identity_id}:{action_type}"
+
+    @staticmethod
+    def _daily_key(identity_id: int, action_type: str) -> str:
+        return f"rl:daily:{identity_id}:{action_type}:{date.today().isoformat()}"
+
+    def _redis_usage(self, pairs: list) -> list:
+        """(hourly_used, daily_used) for each (identity_id, action_type), in one round-trip."""
+        one_hour_ago = time.time() - 3600
+        pipe = self.redis.pipeline(transaction=False)
+        for identity_id, action_type in pairs:
+            key = self._hourly_key(identity_id, action_type)
+            pipe.zremrangebyscore(key, 0, one_hour_ago)
+            pipe.zcard(key)
+            pipe.get(self._daily_key(identity_id, action_type))
+        results = pipe.execute()
+        return [
+            (results[i + 1], int(results[i + 2] or 0))
+            for i in range(0, len(results), 3)
+        ]
+
+    def first_available(self, identity_ids: list, action_type: str) -> Optional[int]:
+        """First of `identity_ids` under both limits for `action_type` (Redis backend)."""
+        if not identity_ids:
+            return None
+        limits = self._get_limits(action_type)
+        usage = self._redis_usage([(identity_id, action_type) for identity_id in identity_ids])
+        for identity_id, (hourly_used, daily_used) in zip(identity_ids, usage):
+            if daily_used < limits['daily'] and hourly_used < limits['hourly']:
+                return identity_id
+        return None
+
+    @staticmethod
+    def _hourly_counts(record, window_start: datetime) -> Tuple[int, int]:
+        """(previous, current) counts of `record`, rotated to the window at `window_start`."""
+        if record.hourly_window_start == window_start:
+            return record.hourly_previous_count or 0, record.hourly_current_count or 0
+        if record.hourly_window_start == window_start - timedelta(hours=1):
+            return record.hourly_current_count or 0, 0
+        return 0, 0
+
+    @staticmethod
+    def _hourly_wait(previous: int, current: int, weight: float, limit: int) -> int:
+        """Seconds until the estimated hourly count drops under `limit`."""
+        if current < limit:
+            # The previous hour's share decays during this one
+            return max(0, math.ceil(3600 * (weight - (limit - current) / previous)))
+        # Wait for the next hour, where this hour's share decays in turn
+        return math.ceil(3600 * weight) + math.ceil(3600 * (1 - limit / current))
 
     def can_request(self, identity_id: int, action_type: str) -> Tuple[bool, int]:
         """Check if a request can be made.
@@ -76,45 +225,130 @@ class DBRateLimiter:
         hourly_limit = limits['hourly']
         daily_limit = limits['daily']
 
-        with get_session() as session:
-            record = self._get_or_create_record(session, identity_id, action_type)
+        if self.redis is not None:
+            [(hourly_used, daily_used)] = self._redis_usage([(identity_id, action_type)])
+            if daily_used >= daily_limit:
+                return False, _seconds_until_midnight()
+            if hourly_used >= hourly_limit:
+                # Only the oldest entry is fetched, and only when over the limit
+                oldest = self.redis.zrange(self._hourly_key(identity_id, action_type), 0, 0, withscores=True)
+                wait_seconds = max(0, int(oldest[0][1] + 3600 - time.time())) if oldest else 0
+                return False, wait_seconds
+            return True, 0
 
-            # Clean up old hourly timestamps
-            hourly_timestamps = self._prune_hourly_timestamps(record.hourly_timestamps or [])
+        with get_session() as session:
+            record = session.execute(_counters_stmt, {
+                'identity_id': identity_id, 'action_type': action_type, 'date': date.today(),
+            }).first()
+        if record is None:
+            # No request yet today (record_request creates the record)
+            return True, 0
 
-            # Check daily limit
-            if record.daily_count >= daily_limit:
-                # Calculate seconds until midnight
-                now = datetime.utcnow()
-                tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
-                wait_seconds = int((tomorrow - now).total_seconds())
-                return False, wait_seconds
+        # Check daily limit
+        if (record.daily_count or 0) >= daily_limit:
+            return False, _seconds_until_midnight()
 
-            # Check hourly limit
-            if len(hourly_timestamps) >= hourly_limit:
-                # Calculate when oldest timestamp will expire
-                oldest = datetime.fromisoformat(hourly_timestamps[0])
-                wait_until = oldest + timedelta(hours=1)
-                wait_seconds = max(0, int((wait_until - datetime.utcnow()).total_seconds()))
-                return False, wait_seconds
+        # Check hourly limit
+        window_start, weight = _hourly_window(time.time())
+        previous, current = self._hourly_counts(record, window_start)
+        if previous * weight + current >= hourly_limit:
+            return False, self._hourly_wait(previous, current, weight, hourly_limit)
 
-            return True, 0
+        return True, 0
 
     def record_request(self, identity_id: int, action_type: str):
         """Record a request was made."""
+        if self.redis is not None:
+            now = time.time()
+            hourly_key = self._hourly_key(identity_id, action_type)
+            daily_key = self._daily_key(identity_id, action_type)
+            pipe = self.redis.pipeline()
+            pipe.zadd(hourly_key, {f"{now:.6f}:{uuid.uuid4().hex[:8]}": now})
+            pipe.expire(hourly_key, 3600)
+            pipe.incr(daily_key)
+            pipe.expire(daily_key, 86400)
+            pipe.execute()
+            return
+
         with get_session() as session:
-            record = self._get_or_create_record(session, identity_id, action_type)
+            session.execute(self._record_stmt(identity_id, action_type))
+
+    def try_consume(self, identity_id: int, action_type: str) -> Tuple[bool, int]:
+        """Check the limits and record the request in one atomic step.
+
+        Unlike `can_request` followed by `record_request`, concurrent callers
+        cannot both pass the check before either records.
 
-            now = datetime.utcnow()
+        Args:
+            identity_id: Identity ID
+            action_type: Type of action (profile_visit, search, etc.)
 
-            # Update hourly timestamps
-            hourly_timestamps = self._prune_hourly_timestamps(record.hourly_timestamps or [])
-            hourly_timestamps.append(now.isoformat())
-            record.hourly_timestamps = hourly_timestamps
+        Returns:
+            Tuple of (recorded, wait_seconds), as for `can_request`
+        """
+        limits = self._get_limits(action_type)
 
-            # Update daily count
-            record.daily_count = (record.daily_count or 0) + 1
-            record.last_request_at = now
+        if self.redis is not None:
+            if self._consume_script is None:
+                self._consume_script = self.redis.register_script(_CONSUME_SCRIPT)
+            now = time.time()
+            ok, wait_seconds = self._consume_script(
+                keys=[self._hourly_key(identity_id, action_type), self._daily_key(identity_id, action_type)],
+                args=[now, f"{now:.6f}:{uuid.uuid4().hex[:8]}", limits['hourly'], limits['daily']],
+            )
+            if ok:
+                return True, 0
+            return False, _seconds_until_midnight() if wait_seconds < 0 else int(wait_seconds)
+
+        # The upsert only updates a record that is under both limits
+        stmt = self._record_stmt(identity_id, action_type, limits).returning(RateLimit.id)
+        with get_session() as session:
+            recorded = session.execute(stmt).scalar() is not None
+        if recorded:
+            return True, 0
+        # Rejected: one more read for the wait time
+        _, wait_seconds = self.can_request(identity_id, action_type)
+        return False, wait_seconds
+
+    def _record_stmt(self, identity_id: int, action_type: str, limits: Optional[dict] = None):
+        """Upsert creating today's record or counting one more request in it.
+
+        With `limits`, an existing record is only updated while under them.
+        """
+        window_start, _ = _hourly_window(time.time())
+        in_window = RateLimit.hourly_window_start == window_start
+
+        # Create today's record or bump it in one statement (no read first)
+        stmt = insert(RateLimit).values(
+            identity_id=identity_id,
+            action_type=action_type,
+            date=date.today(),
+            hourly_window_start=window_start,
+            hourly_current_count=1,
+            hourly_previous_count=0,
+            daily_count=1,
+            last_request_at=datetime.utcnow(),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimit.identity_id, RateLimit.action_type, RateLimit.date],
+            set_={
+                # Rotate the counters when a new hour has started
+                'hourly_previous_count': case(
+                    (in_window, RateLimit.hourly_previous_count),
+                    (
+                        RateLimit.hourly_window_start == window_start - timedelta(hours=1),
+                        RateLimit.hourly_current_count,
+                    ),
+                    else_=0,
+                ),
+                'hourly_current_count': case((in_window, RateLimit.hourly_current_count + 1), else_=1),
+                'hourly_window_start': window_start,
+                'daily_count': func.coalesce(RateLimit.daily_count, 0) + 1,
+                'last_request_at': stmt.excluded.last_request_at,
+            },
+            where=self._under_limits(limits) if limits else None,
+        )
+        return stmt
 
     def get_stats(self, identity_id: int, action_type: Optional[str] = None) -> dict:
         """Get rate limit stats for identity.
@@ -126,6 +360,9 @@ class DBRateLimiter:
         Returns:
             Dict with usage stats
         """
+        if self.redis is not None:
+            return self._redis_stats(identity_id, action_type)
+
         with get_session() as session:
             query = session.query(RateLimit).filter(
                 RateLimit.identity_id == identity_id,
@@ -136,14 +373,15 @@ class DBRateLimiter:
                 query = query.filter(RateLimit.action_type == action_type)
 
             records = query.all()
+            window_start, weight = _hourly_window(time.time())
 
             stats = {}
             for record in records:
                 limits = self._get_limits(record.action_type)
-                hourly_timestamps = self._prune_hourly_timestamps(record.hourly_timestamps or [])
+                previous, current = self._hourly_counts(record, window_start)
 
                 stats[record.action_type] = {
-                    'hourly_used': len(hourly_timestamps),
+                    'hourly_used': round(previous * weight + current),
                     'hourly_limit': limits['hourly'],
                     'daily_used': record.daily_count,
                     'daily_limit': limits['daily'],
@@ -152,8 +390,57 @@ class DBRateLimiter:
 
             return stats
 
+    def _redis_stats(self, identity_id: int, action_type: Optional[str]) -> dict:
+        prefix = f"rl:daily:{identity_id}:"
+        suffix = f":{date.today().isoformat()}"
+        if action_type:
+            actions = [action_type]
+        else:
+            actions = [
+                (key.decode() if isinstance(key, bytes) else key)[len(prefix):-len(suffix)]
+                for key in self.redis.scan_iter(match=f"{prefix}*{suffix}")
+            ]
+
+        usage = self._redis_usage([(identity_id, action) for action in actions])
+        pipe = self.redis.pipeline(transaction=False)
+        for action in actions:
+            pipe.zrange(self._hourly_key(identity_id, action), -1, -1, withscores=True)
+        latest = pipe.execute()
+
+        stats = {}
+        for action, (hourly_used, daily_used), last in zip(actions, usage, latest):
+            if not daily_used:
+                continue
+            limits = self._get_limits(action)
+            stats[action] = {
+                'hourly_used': hourly_used,
+                'hourly_limit': limits['hourly'],
+                'daily_used': daily_used,
+                'daily_limit': limits['daily'],
+                'last_request': datetime.utcfromtimestamp(last[0][1]).isoformat() if last else None,
+            }
+        return stats
+
+    def purge(self, days: int = 7) -> int:
+        """Delete records older than `days` days (only today's are ever read).
+
+        Returns:
+            Number of records deleted
+        """
+        cutoff = date.today() - timedelta(days=days)
+        with get_session() as session:
+            return session.execute(delete(RateLimit).where(RateLimit.date < cutoff)).rowcount
+
     def reset_daily(self, identity_id: int, action_type: Optional[str] = None):
         """Reset daily counters (for testing or manual reset)."""
+        if self.redis is not None:
+            action = action_type or '*'
+            keys = list(self.redis.scan_iter(match=f"rl:{identity_id}:{action}"))
+            keys += list(self.redis.scan_iter(match=f"rl:daily:{identity_id}:{action}:*"))
+            if keys:
+                self.redis.delete(*keys)
+            return
+
         with get_session() as session:
             query = session.query(RateLimit).filter(
                 RateLimit.identity_id == identity_id
@@ -1,74 +1,116 @@
 """Secrets management service with Fernet encryption."""
 
+import asyncio
 import os
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 
 from cryptography.fernet import Fernet, InvalidToken
 
+from sqlalchemy import bindparam, func, lambda_stmt, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import TTLCache
 from .models import Secret, SecretScope
 from .database import get_session
 
 
+_MISSING = object()
+
+# Conflict target matching the ix_secret_lookup unique index
+_SECRET_KEY = [Secret.key, Secret.scope, func.coalesce(Secret.user_id, 0)]
+
+# One secret by key/scope/owner (owner 0 for platform), compiled once
+_secret_stmt = lambda_stmt(lambda: select(
+    Secret.encrypted_value, Secret.expires_at
+).where(
+    Secret.key == bindparam('key'),
+    Secret.scope == bindparam('scope'),
+    func.coalesce(Secret.user_id, 0) == bindparam('owner'),
+).limit(1))
+
+
+@lru_cache(maxsize=1)
+def _get_fernet() -> Fernet:
+    """Fernet cipher from SECRETS_MASTER_KEY, built once per process."""
+    master_key = os.environ.get('SECRETS_MASTER_KEY')
+    if not master_key:
+        raise ValueError(
+            "SECRETS_MASTER_KEY not set. "
+            "Generate with: python -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\""
+        )
+    return Fernet(master_key.encode())
+
+
 class SecretsService:
-    """Service for encrypted secrets management."""
+    """Service for encrypted secrets management.
+
+    Decrypted rows are cached in-process for SECRETS_CACHE_TTL seconds
+    (default 60, 0 disables), keyed by (key, scope, user_id); absent rows
+    are cached too. `set`/`delete` invalidate this process's entries only.
+    """
 
     def __init__(self):
-        self._fernet: Optional[Fernet] = None
+        self._cache = TTLCache(maxsize=1024, ttl=float(os.environ.get('SECRETS_CACHE_TTL', '60')))
 
     @property
     def fernet(self) -> Fernet:
-        """Lazy-load Fernet cipher from SECRETS_MASTER_KEY."""
-        if self._fernet is None:
-            master_key = os.environ.get('SECRETS_MASTER_KEY')
-            if not master_key:
-                raise ValueError(
-                    "SECRETS_MASTER_KEY not set. "
-                    "Generate with: python -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\""
-                )
-            self._fernet = Fernet(master_key.encode())
-        return self._fernet
+        """Fernet cipher from SECRETS_MASTER_KEY (shared by all instances)."""
+        return _get_fernet()
 
     def encrypt(self, value: str) -> str:
         """Encrypt a value."""
-        return self.fernet.encrypt(value.encode()).decode()
+        return _get_fernet().encrypt(value.encode()).decode()
 
     def decrypt(self, encrypted_value: str) -> str:
         """Decrypt a value."""
         try:
-            return self.fernet.decrypt(encrypted_value.encode()).decode()
+            return _get_fernet().decrypt(encrypted_value.encode()).decode()
         except InvalidToken:
             raise ValueError("Invalid encryption key or corrupted data")
 
+    @staticmethod
+    def _scopes(user_id: Optional[int]) -> list[tuple[SecretScope, Optional[int]]]:
+        """(scope, user_id) pairs to look a key up in, by priority."""
+        if user_id:
+            return [(SecretScope.USER, user_id), (SecretScope.PLATFORM, None)]
+        return [(SecretScope.PLATFORM, None)]
+
+    def _entry(self, row) -> Optional[tuple[str, Optional[datetime]]]:
+        """Cache entry for a secret row: (plaintext, expires_at), or None if no row."""
+        return (self.decrypt(row.encrypted_value), row.expires_at) if row else None
+
+    @staticmethod
+    def _resolve(entries: list) -> Optional[str]:
+        """Value of the first existing entry, unless it has expired."""
+        for entry in entries:
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at and expires_at < datetime.utcnow():
+                    return None
+                return value
+        return None
+
     def get(self, key: str, user_id: Optional[int] = None) -> Optional[str]:
         """Get and decrypt a secret.
 
         Priority: user-scoped (if user_id provided) > platform-scoped.
         """
-        with get_session() as session:
-            # Try user-scoped first if user_id provided
-            if user_id:
-                secret = session.query(Secret).filter(
-                    Secret.key == key,
-                    Secret.scope == SecretScope.USER,
-                    Secret.user_id == user_id
-                ).first()
-                if secret:
-                    if secret.expires_at and secret.expires_at < datetime.utcnow():
-                        return None
-                    return self.decrypt(secret.encrypted_value)
-
-            # Fall back to platform-scoped
-            secret = session.query(Secret).filter(
-                Secret.key == key,
-                Secret.scope == SecretScope.PLATFORM
-            ).first()
-            if secret:
-                if secret.expires_at and secret.expires_at < datetime.utcnow():
-                    return None
-                return self.decrypt(secret.encrypted_value)
+        entries = []
+        for scope, owner in self._scopes(user_id):
+            entry = self._cache.get((key, scope, owner), _MISSING)
+            if entry is _MISSING:
+                with get_session() as session:
+                    entry = self._entry(session.execute(
+                        _secret_stmt, {'key': key, 'scope': scope, 'owner': owner or 0}
+                    ).first())
+                self._cache.set((key, scope, owner), entry)
+            entries.append(entry)
+            if entry is not None:
+                break
 
-        return None
+        return self._resolve(entries)
 
     def set(
         self,
@@ -81,38 +123,72 @@ class SecretsService:
     ) -> Secret:
         """Encrypt and store a secret. Updates if exists, creates otherwise."""
         encrypted = self.encrypt(value)
+        now = datetime.utcnow()
 
         with get_session() as session:
-            query = session.query(Secret).filter(
-                Secret.key == key,
-                Secret.scope == scope
+            stmt = insert(Secret).values(
+                key=key,
+                scope=scope,
+                user_id=user_id if scope == SecretScope.USER else None,
+                encrypted_value=encrypted,
+                description=description,
+                expires_at=expires_at,
+                created_at=now,
+                updated_at=now,
             )
-            if scope == SecretScope.USER:
-                query = query.filter(Secret.user_id == user_id)
-            else:
-                query = query.filter(Secret.user_id.is_(None))
+            stmt = stmt.on_conflict_do_update(index_elements=_SECRET_KEY, set_=self._upsert_set(stmt))
+            secret = session.scalars(stmt.returning(Secret)).one()
+            # RETURNING loaded every column: detach so the commit doesn't expire them
+            session.expunge(secret)
 
-            secret = query.first()
+        self._cache.pop((key, scope, user_id if scope == SecretScope.USER else None))
+        return secret
 
-            if secret:
-                secret.encrypted_value = encrypted
-                secret.description = description
-                secret.expires_at = expires_at
-                secret.updated_at = datetime.utcnow()
-            else:
-                secret = Secret(
-                    key=key,
-                    scope=scope,
-                    user_id=user_id if scope == SecretScope.USER else None,
-                    encrypted_value=encrypted,
-                    description=description,
-                    expires_at=expires_at
-                )
-                session.add(secret)
+    def set_many(
+        self,
+        items: list[tuple[str, str]],
+        scope: SecretScope = SecretScope.PLATFORM,
+        user_id: Optional[int] = None,
+        description: Optional[str] = None,
+        expires_at: Optional[datetime] = None
+    ) -> int:
+        """Encrypt and store several secrets of one scope in a single upsert.
 
+        Args:
+            items: (key, value) pairs; the last value wins for repeated keys
+            scope, user_id, description, expires_at: As for `set`, applied to every item
+
+        Returns:
+            Number of secrets written
+        """
+        owner = user_id if scope == SecretScope.USER else None
+        encrypted = {key: self.encrypt(value) for key, value in items}
+        if not encrypted:
+            return 0
+        now = datetime.utcnow()
+
+        with get_session() as session:
+            stmt = insert(Secret).values([
+                {'key': key, 'scope': scope, 'user_id': owner, 'encrypted_value': value,
+                 'description': description, 'expires_at': expires_at, 'created_at': now, 'updated_at': now}
+                for key, value in encrypted.items()
+            ])
+            session.execute(stmt.on_conflict_do_update(index_elements=_SECRET_KEY, set_=self._upsert_set(stmt)))
             session.commit()
-            session.refresh(secret)
-            return secret
+
+        for key in encrypted:
+            self._cache.pop((key, scope, owner))
+        return len(encrypted)
+
+    @staticmethod
+    def _upsert_set(stmt) -> dict:
+        """Columns an upsert overwrites on an existing secret."""
+        return {
+            'encrypted_value': stmt.excluded.encrypted_value,
+            'description': stmt.excluded.description,
+            'expires_at': stmt.excluded.expires_at,
+            'updated_at': stmt.excluded.updated_at,
+        }
 
     def delete(self, key: str, scope: SecretScope = SecretScope.PLATFORM, user_id: Optional[int] = None) -> bool:
         """Delete a secret. Returns True if deleted."""
@@ -130,6 +206,7 @@ class SecretsService:
             if secret:
                 session.delete(secret)
                 session.commit()
+                self._cache.pop((key, scope, user_id if scope == SecretScope.USER else None))
                 return True
         return False
 
@@ -164,14 +241,49 @@ class SecretsService:
         """Get multiple secrets for task execution.
 
         Returns a dict of key -> decrypted value for injection into env.
+        Same precedence as `get`; keys not cached are loaded in one query.
         """
+        scopes = self._scopes(user_id)
+        entries = {
+            (key, scope, owner): self._cache.get((key, scope, owner), _MISSING)
+            for key in keys for scope, owner in scopes
+        }
+
+        missing = {key for (key, _, _), entry in entries.items() if entry is _MISSING}
+        if missing:
+            with get_session() as session:
+                condition = Secret.scope == SecretScope.PLATFORM
+                if user_id:
+                    condition = condition | ((Secret.scope == SecretScope.USER) & (Secret.user_id == user_id))
+                rows = session.query(
+                    Secret.key, Secret.scope, Secret.encrypted_value, Secret.expires_at
+                ).filter(Secret.key.in_(missing), condition).order_by(Secret.id).all()
+
+            # First row per key and scope, like `get`
+            found = {}
+            for row in rows:
+                found.setdefault((row.key, row.scope), row)
+            for key in missing:
+                for scope, owner in scopes:
+                    entry = self._entry(found.get((key, scope)))
+                    entries[(key, scope, owner)] = entry
+                    self._cache.set((key, scope, owner), entry)
+
         result = {}
         for key in keys:
-            value = self.get(key, user_id)
+            value = self._resolve([entries[(key, scope, owner)] for scope, owner in scopes])
             if value:
                 result[key] = value
         return result
 
+    async def get_async(self, key: str, user_id: Optional[int] = None) -> Optional[str]:
+        """`get` for async callers: the query and decryption run in a worker thread."""
+        return await asyncio.to_thread(self.get, key, user_id)
+
+    async def get_for_task_async(self, keys: list[str], user_id: Optional[int] = None) -> dict[str, str]:
+        """`get_for_task` for async callers, off the event loop."""
+        return await asyncio.to_thread(self.get_for_task, keys, user_id)
+
 
 # Singleton instance
 secrets_service = SecretsService()
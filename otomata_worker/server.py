@@ -1,17 +1,17 @@
 """FastAPI server with REST API, SSE streaming, and integrated worker."""
 
 import asyncio
-import json
 import os
 import logging
 from typing import Optional
 
+import orjson
 from fastapi import FastAPI, HTTPException, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from .database import init_db
+from .database import get_session, init_db
 from .task_manager import TaskManager
 from .chat_manager import ChatManager
 from .events import event_store
@@ -19,6 +19,18 @@ from .worker import async_poll_loop
 
 logger = logging.getLogger(__name__)
 
+# --- Responses ---
+
+def _sse_frame(event: dict) -> bytes:
+    """One SSE `data:` frame, already encoded."""
+    return b"data: " + orjson.dumps(event, option=orjson.OPT_NON_STR_KEYS) + b"\n\n"
+
+
+_KEEPALIVE_FRAME = b": keepalive\n\n"
+_COMPLETE_FRAME = _sse_frame({'type': 'complete'})
+_NO_TASK_FRAME = _sse_frame({'type': 'no_task'})
+
+
 # --- Auth ---
 
 API_KEY = os.environ.get('OTOMATA_API_KEY', '')
@@ -58,7 +70,7 @@ class SendMessageRequest(BaseModel):
 # --- App factory ---
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Otomata Worker")
+    app = FastAPI(title="Otomata Worker", default_response_class=ORJSONResponse)
 
     # CORS
     origins = os.environ.get('CORS_ORIGINS', '*').split(',')
@@ -102,11 +114,15 @@ def create_app() -> FastAPI:
     # --- Chats ---
 
     @app.get("/chats", dependencies=[Depends(verify_api_key)])
-    def list_chats(tenant: Optional[str] = None, metadata_client_id: Optional[str] = None):
+    def list_chats(
+        tenant: Optional[str] = None,
+        metadata_client_id: Optional[str] = None,
+        limit: Optional[int] = None,
+    ):
         meta_filter = {}
         if metadata_client_id:
             meta_filter['client_id'] = metadata_client_id
-        return chat_manager.list_chats(tenant=tenant, metadata_filter=meta_filter or None)
+        return chat_manager.list_chats(tenant=tenant, metadata_filter=meta_filter or None, limit=limit)
 
     @app.post("/chats", status_code=201, dependencies=[Depends(verify_api_key)])
     def create_chat(req: CreateChatRequest):
@@ -139,29 +155,34 @@ def create_app() -> FastAPI:
 
     @app.get("/chats/{chat_id}/messages", dependencies=[Depends(verify_api_key)])
     def list_messages(chat_id: int, include_tools: bool = False):
-        chat = chat_manager.get_chat(chat_id)
-        if not chat:
-            raise HTTPException(404, "Chat not found")
-        return chat_manager.list_messages(chat_id, include_tools=include_tools)
+        with get_session() as session:
+            chat = chat_manager.get_chat(chat_id, session=session)
+            if not chat:
+                raise HTTPException(404, "Chat not found")
+            messages = chat_manager.list_messages(chat_id, include_tools=include_tools, session=session)
+        return messages
 
     @app.post("/chats/{chat_id}/messages", status_code=202, dependencies=[Depends(verify_api_key)])
     def send_message(chat_id: int, req: SendMessageRequest):
-        chat = chat_manager.get_chat(chat_id)
-        if not chat:
-            raise HTTPException(404, "Chat not found")
-
-        # Check no active task already
-        active = task_manager.get_active_task_for_chat(chat_id)
-        if active:
-            raise HTTPException(409, f"Chat already has active task {active.id}")
-
-        # Create agent task linked to chat
-        task_id = task_manager.create(
-            task_type='agent',
-            prompt=req.content,
-            workspace=chat.get('workspace'),
-            chat_id=chat_id,
-        )
+        # One transaction for the lookups and the insert
+        with get_session() as session:
+            chat = chat_manager.get_chat(chat_id, session=session)
+            if not chat:
+                raise HTTPException(404, "Chat not found")
+
+            # Check no active task already
+            active_id = task_manager.get_active_task_id_for_chat(chat_id, session=session)
+            if active_id:
+                raise HTTPException(409, f"Chat already has active task {active_id}")
+
+            # Create agent task linked to chat
+            task_id = task_manager.create(
+                task_type='agent',
+                prompt=req.content,
+                workspace=chat.get('workspace'),
+                chat_id=chat_id,
+                session=session,
+            )
         return {"task_id": task_id}
 
     @app.get("/chats/{chat_id}/events", dependencies=[Depends(verify_api_key)])
@@ -169,34 +190,53 @@ def create_app() -> FastAPI:
         """SSE endpoint streaming events for the active task of a chat."""
         async def event_stream():
             # Find active task
-            task = task_manager.get_active_task_for_chat(chat_id)
-            if not task:
-                yield f"data: {json.dumps({'type': 'no_task'})}\n\n"
+            task_id = task_manager.get_active_task_id_for_chat(chat_id)
+            if not task_id:
+                yield _NO_TASK_FRAME
                 return
 
-            task_id = task.id
-            event_index = 0
-
-            while True:
-                events = event_store.get_events(task_id, after_index=event_index)
-
-                for event in events:
-                    yield f"data: {json.dumps(event)}\n\n"
-                    event_index += 1
-
-                    if event['type'] in ('complete', 'error'):
+            subscriber, events, event_index = await event_store.subscribe(task_id)
+            try:
+                while True:
+                    for event in events:
+                        yield _sse_frame(event)
+
+                        if event['type'] in ('complete', 'error'):
+                            return
+
+                    if subscriber.overflowed:
+                        # Fell too far behind the queue: catch up from the store
+                        subscriber.overflowed = False
+                        events, event_index = await event_store.read_async(task_id, after_index=event_index)
+                        continue
+
+                    # Finished in this process (the worker cleaned it up)
+                    if subscriber.closed and subscriber.queue.empty():
+                        yield _COMPLETE_FRAME
                         return
 
-                has_new = await event_store.wait_for_event(task_id, timeout=30.0)
-                if not has_new:
-                    # Keepalive
-                    yield ": keepalive\n\n"
-
-                    # Check if task finished (DB)
-                    t = task_manager.get(task_id)
-                    if t and t.status.value in ('completed', 'failed'):
-                        yield f"data: {json.dumps({'type': 'complete'})}\n\n"
-                        return
+                    try:
+                        item = await asyncio.wait_for(subscriber.queue.get(), timeout=30.0)
+                    except asyncio.TimeoutError:
+                        yield _KEEPALIVE_FRAME
+
+                        # Run by another process: only the DB knows when it ends
+                        if not event_store.is_tracked(task_id):
+                            if task_manager.get_status(task_id) in ('completed', 'failed'):
+                                yield _COMPLETE_FRAME
+                                return
+                        events = []
+                        continue
+
+                    if item is None:
+                        events = []
+                        continue
+                    # Batches may overlap what was already sent: skip by index
+                    start, batch = item
+                    events = batch[max(0, event_index - start):]
+                    event_index = max(event_index, start + len(batch))
+            finally:
+                event_store.unsubscribe(task_id, subscriber)
 
         return StreamingResponse(
             event_stream(),
@@ -231,24 +271,17 @@ def create_app() -> FastAPI:
     def list_tasks(status: Optional[str] = None, limit: int = 50):
         from .models import TaskStatus
         filter_status = TaskStatus(status) if status else None
-        return task_manager.list_tasks(status=filter_status, limit=limit)
+        return Response(
+            task_manager.list_tasks_json(status=filter_status, limit=limit),
+            media_type="application/json",
+        )
 
     @app.get("/tasks/{task_id}", dependencies=[Depends(verify_api_key)])
     def get_task(task_id: int):
-        task = task_manager.get(task_id)
+        task = task_manager.get_summary(task_id)
         if not task:
             raise HTTPException(404, "Task not found")
-        return {
-            'id': task.id,
-            'task_type': task.task_type,
-            'status': task.status.value,
-            'chat_id': task.chat_id,
-            'claimed_by': task.claimed_by,
-            'created_at': task.created_at.isoformat() if task.created_at else None,
-            'started_at': task.started_at.isoformat() if task.started_at else None,
-            'completed_at': task.completed_at.isoformat() if task.completed_at else None,
-            'error': task.error,
-        }
+        return task
 
     @app.post("/tasks/{task_id}/retry", dependencies=[Depends(verify_api_key)])
     def retry_task(task_id: int):
@@ -271,13 +304,15 @@ def create_app() -> FastAPI:
     def get_available_identity(platform: str, action: Optional[str] = None):
         """Get an available identity with decrypted cookie for the given platform."""
         mgr = _get_identity_manager()
-        identity_id = mgr.get_available(platform, action_type=action)
-        if not identity_id:
-            raise HTTPException(404, f"No available identity for {platform}")
-
-        identity = mgr.get_by_id(identity_id)
-        cookie = mgr.get_cookie(identity_id)
-        mgr.mark_used(identity_id)
+        # Select, read and mark used in one transaction
+        with get_session() as session:
+            identity_id = mgr.get_available(platform, action_type=action, session=session)
+            if not identity_id:
+                raise HTTPException(404, f"No available identity for {platform}")
+
+            identity = mgr.get_by_id(identity_id, session=session)
+            cookie = mgr.get_cookie(identity_id, session=session)
+            mgr.mark_used(identity_id, session=session)
 
         return {
             "identity_name": identity["name"],
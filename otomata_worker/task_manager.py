@@ -1,12 +1,147 @@
 """Task management - create, claim, complete tasks."""
 
-from datetime import datetime
-from typing import Optional
-
-from sqlalchemy import text
-
-from .models import Task, TaskStatus
-from .database import get_session
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Iterator, Optional
+
+import orjson
+from sqlalchemy import Integer, Interval, bindparam, delete, func, select, tuple_, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from .models import Task, TaskEvent, TaskStatus
+from .database import get_db_engine, get_session
+
+# Serialization failures (SQLSTATE 40001) retried by claims, with backoff
+_CLAIM_RETRIES = 5
+
+# Transaction time in UTC, as naive timestamps like created_at: set by the
+# database so timestamps follow commit order, whatever the worker clocks
+_NOW = func.timezone('UTC', func.now())
+
+
+@dataclass(slots=True)
+class TaskOut:
+    """Public fields of a task, as returned by the API.
+
+    orjson serializes it directly (status as its value, datetimes in ISO).
+    """
+    id: int
+    task_type: str
+    status: TaskStatus
+    chat_id: Optional[int]
+    claimed_by: Optional[str]
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    completed_at: Optional[datetime]
+    error: Optional[str]
+
+
+_TASK_OUT_COLUMNS = (
+    Task.id, Task.task_type, Task.status, Task.chat_id, Task.claimed_by,
+    Task.created_at, Task.started_at, Task.completed_at, Task.error,
+)
+
+
+@dataclass(slots=True)
+class TaskView:
+    """A claimed task: what the worker needs to run it.
+
+    Plain data built from the claim's RETURNING row, so nothing can
+    lazy-load or expire once the claim transaction is over.
+    """
+    id: int
+    task_type: str
+    script_path: Optional[str]
+    params: Optional[dict]
+    prompt: Optional[str]
+    session_id: Optional[str]
+    workspace: Optional[str]
+    chat_id: Optional[int]
+    claimed_by: Optional[str]
+    claimed_until: Optional[datetime]
+    created_at: Optional[datetime]
+
+
+_TASK_VIEW_COLUMNS = (
+    Task.id, Task.task_type, Task.script_path, Task.params, Task.prompt,
+    Task.session_id, Task.workspace, Task.chat_id, Task.claimed_by,
+    Task.claimed_until, Task.created_at,
+)
+
+
+def _skip_locked() -> bool:
+    """Whether claims lock candidates with FOR UPDATE SKIP LOCKED.
+
+    CLAIM_STRATEGY=atomic (the default on CockroachDB, where SKIP LOCKED
+    is slow and may skip rows) claims with a plain UPDATE instead and
+    relies on the status re-check and serialization retries.
+    """
+    strategy = os.environ.get('CLAIM_STRATEGY')
+    if strategy:
+        return strategy != 'atomic'
+    return get_db_engine().dialect.name != 'cockroachdb'
+
+
+@lru_cache(maxsize=None)
+def _claim_stmt(skip_locked: bool, finish: Optional[TaskStatus] = None, sharded: bool = False):
+    """WITH pending AS (SELECT ... [FOR UPDATE SKIP LOCKED]) UPDATE ... RETURNING.
+
+    Built once per variant, with bound parameters (worker_id, limit, lease;
+    task_id, task_session_id and task_result or task_error when `finish`
+    also closes a task; shard and shards when `sharded`), so each claim only binds values
+    to an already-compiled statement.
+
+    The candidates are a CTE, picked once: as an IN (subquery) the planner
+    may re-run the LIMIT per row and claim more than `limit` tasks.
+    """
+    pending = select(Task.id).where(
+        Task.status == TaskStatus.PENDING
+    ).order_by(Task.created_at).limit(bindparam('limit', type_=Integer))
+    if sharded:
+        pending = pending.where(
+            func.mod(Task.id, bindparam('shards', type_=Integer)) == bindparam('shard', type_=Integer)
+        )
+    if skip_locked:
+        pending = pending.with_for_update(skip_locked=True)
+    pending = pending.cte('pending')
+    # Status re-checked on the locked row: a concurrent claim makes it a no-op
+    stmt = update(Task).where(
+        Task.id == pending.c.id, Task.status == TaskStatus.PENDING
+    ).values(
+        status=TaskStatus.RUNNING,
+        claimed_by=bindparam('worker_id'),
+        started_at=_NOW,
+        claimed_until=_NOW + bindparam('lease', type_=Interval),
+    ).returning(*_TASK_VIEW_COLUMNS)
+
+    if finish is not None:
+        outcome = 'result' if finish == TaskStatus.COMPLETED else 'error'
+        finished = update(Task).where(Task.id == bindparam('task_id')).values({
+            'status': finish,
+            'completed_at': _NOW,
+            outcome: bindparam(f'task_{outcome}'),
+            'session_id': func.coalesce(bindparam('task_session_id'), Task.session_id),
+        }).returning(Task.id).cte('finished')
+        stmt = stmt.add_cte(finished)
+    return stmt
+
+
+def _claim_params(
+    worker_id: str, limit: int, lease: Optional[float], shard: Optional[tuple[int, int]] = None
+) -> dict:
+    params = {
+        'worker_id': worker_id,
+        'limit': limit,
+        'lease': timedelta(seconds=lease) if lease else None,
+    }
+    if shard:
+        params['shard'], params['shards'] = shard
+    return params
 
 
 class TaskManager:
@@ -20,7 +155,8 @@ class TaskManager:
         prompt: Optional[str] = None,
         workspace: Optional[str] = None,
         session_id: Optional[str] = None,
-        chat_id: Optional[int] = None
+        chat_id: Optional[int] = None,
+        session: Optional[Session] = None,
     ) -> int:
         """Create a new task.
 
@@ -32,11 +168,12 @@ class TaskManager:
             workspace: Working directory
             session_id: Claude session ID (for resume)
             chat_id: Optional linked chat ID
+            session: Optional session to run in (caller commits)
 
         Returns:
             Created Task ID
         """
-        with get_session() as session:
+        with get_session(session) as session:
             task = Task(
                 task_type=task_type,
                 status=TaskStatus.PENDING,
@@ -52,78 +189,212 @@ class TaskManager:
             task_id = task.id
             return task_id
 
-    def claim(self, worker_id: str) -> Optional[Task]:
+    def claim(self, worker_id: str) -> Optional[TaskView]:
         """Claim the next available pending task.
 
-        Uses SELECT FOR UPDATE SKIP LOCKED for safe concurrent claiming.
+        Args:
+            worker_id: Unique worker identifier (e.g., 'worker-hostname')
+
+        Returns:
+            Claimed TaskView or None if no tasks available
+        """
+        tasks = self.claim_batch(worker_id, 1)
+        return tasks[0] if tasks else None
+
+    def claim_batch(
+        self,
+        worker_id: str,
+        limit: int,
+        lease: Optional[float] = None,
+        shard: Optional[tuple[int, int]] = None,
+    ) -> list[TaskView]:
+        """Claim up to `limit` pending tasks, oldest first, in one statement.
+
+        UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING:
+        concurrent workers never claim the same task.
 
         Args:
             worker_id: Unique worker identifier (e.g., 'worker-hostname')
+            limit: Max tasks to claim
+            lease: Seconds the claims hold before start() (for tasks queued
+                locally); expired ones go back to pending via requeue_expired()
+            shard: (index, count): claim from tasks with id % count == index
+                first, so workers on different shards don't contend for the
+                same rows; falls back to any task when that shard is empty
 
         Returns:
-            Claimed Task or None if no tasks available
+            Claimed TaskViews, oldest first
         """
-        with get_session() as session:
-            # Use raw SQL for SKIP LOCKED (PostgreSQL)
-            result = session.execute(
-                text("""
-                    SELECT id FROM tasks
-                    WHERE status = 'pending'
-                    ORDER BY created_at ASC
-                    LIMIT 1
-                    FOR UPDATE SKIP LOCKED
-                """)
+        if shard:
+            tasks = self._claim(
+                _claim_stmt(_skip_locked(), sharded=True), _claim_params(worker_id, limit, lease, shard)
             )
-            row = result.fetchone()
+            if tasks:
+                return tasks
+        return self._claim(_claim_stmt(_skip_locked()), _claim_params(worker_id, limit, lease))
 
-            if not row:
-                return None
+    def complete_and_claim_next(
+        self,
+        task_id: int,
+        worker_id: str,
+        limit: int,
+        result: Optional[dict] = None,
+        error: Optional[str] = None,
+        lease: Optional[float] = None,
+        shard: Optional[tuple[int, int]] = None,
+        session_id: Optional[str] = None,
+    ) -> list[TaskView]:
+        """Finish a task and claim the next ones in a single statement.
 
-            task = session.query(Task).get(row[0])
-            task.status = TaskStatus.RUNNING
-            task.claimed_by = worker_id
-            task.started_at = datetime.utcnow()
+        The completed/failed UPDATE runs as a CTE of the claim UPDATE, so
+        the steady-state loop costs one round trip per task.
 
-            session.flush()
-            session.expunge(task)
-            return task
+        Args:
+            task_id: Task to finish
+            worker_id: Unique worker identifier
+            limit: Max tasks to claim
+            result: Result data dict (task completed)
+            error: Error message (task failed instead)
+            lease: Claim lease in seconds (see claim_batch)
+            shard: Preferred shard (see claim_batch)
+            session_id: New Claude session ID of the finished task, if any
+
+        Returns:
+            Claimed TaskViews, oldest first
+        """
+        params = _claim_params(worker_id, limit, lease, shard)
+        params['task_id'] = task_id
+        params['task_session_id'] = session_id
+        if error is None:
+            finish, params['task_result'] = TaskStatus.COMPLETED, result
+        else:
+            finish, params['task_error'] = TaskStatus.FAILED, error
+        tasks = self._claim(_claim_stmt(_skip_locked(), finish, sharded=bool(shard)), params)
+        if shard and not tasks:
+            tasks = self.claim_batch(worker_id, limit, lease)
+        return tasks
+
+    def _claim(self, stmt, params: dict) -> list[TaskView]:
+        for attempt in range(_CLAIM_RETRIES):
+            try:
+                with get_session() as session:
+                    rows = session.execute(
+                        stmt, params, execution_options={'synchronize_session': False}
+                    ).all()
+                return sorted((TaskView(*row) for row in rows), key=lambda t: (t.created_at, t.id))
+            except DBAPIError as e:
+                sqlstate = getattr(e.orig, 'pgcode', None) or getattr(e.orig, 'sqlstate', None)
+                if sqlstate != '40001' or attempt == _CLAIM_RETRIES - 1:
+                    raise
+                time.sleep(0.01 * 2 ** attempt * (1 + random.random()))
+
+    def release(self, task_ids: list[int], worker_id: str) -> int:
+        """Put claimed tasks that were never started back to pending.
+
+        Args:
+            task_ids: Task IDs claimed by `worker_id`
+            worker_id: Worker that claimed them
+
+        Returns:
+            Number of tasks released
+        """
+        if not task_ids:
+            return 0
+        with get_session() as session:
+            return session.execute(
+                update(Task).where(
+                    Task.id.in_(task_ids),
+                    Task.status == TaskStatus.RUNNING,
+                    Task.claimed_by == worker_id,
+                ).values(status=TaskStatus.PENDING, claimed_by=None, started_at=None, claimed_until=None)
+            ).rowcount
+
+    def start(self, task: TaskView) -> bool:
+        """Confirm a leased claim before running it, clearing the lease.
+
+        Args:
+            task: Task returned by a claim with a lease
+
+        Returns:
+            False if the lease expired and the task was requeued (skip it)
+        """
+        with get_session() as session:
+            return session.execute(
+                update(Task).where(
+                    Task.id == task.id,
+                    Task.status == TaskStatus.RUNNING,
+                    Task.claimed_by == task.claimed_by,
+                    Task.claimed_until == task.claimed_until,
+                ).values(claimed_until=None).returning(Task.id)
+            ).first() is not None
+
+    def requeue_expired(self) -> int:
+        """Put claims whose lease expired before they started back to pending.
 
-    def complete(self, task_id: int, result: Optional[dict] = None):
+        Returns:
+            Number of tasks requeued
+        """
+        with get_session() as session:
+            return session.execute(
+                update(Task).where(
+                    Task.status == TaskStatus.RUNNING,
+                    Task.claimed_until < _NOW,
+                ).values(status=TaskStatus.PENDING, claimed_by=None, started_at=None, claimed_until=None)
+            ).rowcount
+
+    def complete(self, task_id: int, result: Optional[dict] = None, session_id: Optional[str] = None):
         """Mark task as completed.
 
         Args:
             task_id: Task ID
             result: Result data dict
+            session_id: New Claude session ID, saved in the same UPDATE
         """
+        values = {'session_id': session_id} if session_id else {}
         with get_session() as session:
-            task = session.query(Task).get(task_id)
-            if task:
-                task.status = TaskStatus.COMPLETED
-                task.completed_at = datetime.utcnow()
-                task.result = result
-
-    def fail(self, task_id: int, error: str):
+            session.execute(update(Task).where(Task.id == task_id).values(
+                status=TaskStatus.COMPLETED,
+                completed_at=_NOW,
+                result=result,
+                **values,
+            ))
+
+    def fail(self, task_id: int, error: str, session_id: Optional[str] = None):
         """Mark task as failed.
 
         Args:
             task_id: Task ID
             error: Error message
+            session_id: New Claude session ID, saved in the same UPDATE
         """
+        values = {'session_id': session_id} if session_id else {}
         with get_session() as session:
-            task = session.query(Task).get(task_id)
-            if task:
-                task.status = TaskStatus.FAILED
-                task.completed_at = datetime.utcnow()
-                task.error = error
-
-    def get(self, task_id: int) -> Optional[Task]:
+            session.execute(update(Task).where(Task.id == task_id).values(
+                status=TaskStatus.FAILED,
+                completed_at=_NOW,
+                error=error,
+                **values,
+            ))
+
+    def get(self, task_id: int, session: Optional[Session] = None) -> Optional[Task]:
         """Get task by ID."""
-        with get_session() as session:
-            task = session.query(Task).get(task_id)
+        with get_session(session) as session:
+            task = session.get(Task, task_id)
             if task:
                 session.expunge(task)
             return task
 
+    def get_summary(self, task_id: int, session: Optional[Session] = None) -> Optional[TaskOut]:
+        """Get the public fields of a task (no params, result or prompt loaded)."""
+        with get_session(session) as session:
+            row = session.execute(select(*_TASK_OUT_COLUMNS).where(Task.id == task_id)).first()
+            return TaskOut(*row) if row else None
+
+    def get_status(self, task_id: int, session: Optional[Session] = None) -> Optional[TaskStatus]:
+        """Get only the status of a task (a str enum: compares equal to its value)."""
+        with get_session(session) as session:
+            return session.execute(select(Task.status).where(Task.id == task_id)).scalar()
+
     def list_tasks(
         self,
         status: Optional[TaskStatus] = None,
@@ -138,16 +409,46 @@ class TaskManager:
         Returns:
             List of task dicts
         """
+        return list(self.iter_tasks(status=status, limit=limit))
+
+    def list_tasks_json(
+        self,
+        status: Optional[TaskStatus] = None,
+        limit: int = 50
+    ) -> bytes:
+        """list_tasks() already encoded as JSON (for the API response body).
+
+        Rows go to orjson as-is: status and datetimes are serialized in C,
+        no per-row .value / isoformat() calls.
+        """
         with get_session() as session:
-            query = session.query(Task)
+            query = self._list_query(session, status, limit)
+            rows = [] if query is None else session.execute(query).mappings()
+            return orjson.dumps([dict(row) for row in rows])
 
-            if status:
-                query = query.filter(Task.status == status)
+    def iter_tasks(
+        self,
+        status: Optional[TaskStatus] = None,
+        limit: int = 50,
+        cursor: Optional[int] = None,
+    ) -> Iterator[dict]:
+        """Stream tasks, newest first, fetching rows in batches.
+
+        Args:
+            status: Filter by status
+            limit: Max tasks to return
+            cursor: Only tasks older than this task ID (last ID of the previous page)
 
-            tasks = query.order_by(Task.created_at.desc()).limit(limit).all()
+        Yields:
+            Task dicts
+        """
+        with get_session() as session:
+            query = self._list_query(session, status, limit, cursor)
+            if query is None:
+                return
 
-            return [
-                {
+            for t in session.execute(query.execution_options(yield_per=200)):
+                yield {
                     'id': t.id,
                     'task_type': t.task_type,
                     'status': t.status.value,
@@ -157,12 +458,43 @@ class TaskManager:
                     'completed_at': t.completed_at.isoformat() if t.completed_at else None,
                     'error': t.error,
                 }
-                for t in tasks
-            ]
 
-    def get_active_task_for_chat(self, chat_id: int) -> Optional[Task]:
+    def _list_query(
+        self,
+        session: Session,
+        status: Optional[TaskStatus],
+        limit: int,
+        cursor: Optional[int] = None,
+    ):
+        """Listing query, newest first (None if the cursor task is gone)."""
+        query = select(
+            Task.id,
+            Task.task_type,
+            Task.status,
+            Task.claimed_by,
+            Task.created_at,
+            Task.started_at,
+            Task.completed_at,
+            Task.error,
+        )
+
+        if status:
+            query = query.where(Task.status == status)
+
+        if cursor is not None:
+            # Keyset pagination on (created_at, id): no OFFSET re-scan
+            after = session.execute(
+                select(Task.created_at, Task.id).where(Task.id == cursor)
+            ).first()
+            if after is None:
+                return None
+            query = query.where(tuple_(Task.created_at, Task.id) < tuple_(*after))
+
+        return query.order_by(Task.created_at.desc(), Task.id.desc()).limit(limit)
+
+    def get_active_task_for_chat(self, chat_id: int, session: Optional[Session] = None) -> Optional[Task]:
         """Get the active (pending or running) task for a chat."""
-        with get_session() as session:
+        with get_session(session) as session:
             task = session.query(Task).filter(
                 Task.chat_id == chat_id,
                 Task.status.in_([TaskStatus.PENDING, TaskStatus.RUNNING])
@@ -171,12 +503,20 @@ class TaskManager:
                 session.expunge(task)
             return task
 
+    def get_active_task_id_for_chat(self, chat_id: int, session: Optional[Session] = None) -> Optional[int]:
+        """Get the ID of the active (pending or running) task for a chat."""
+        with get_session(session) as session:
+            return session.execute(
+                select(Task.id).where(
+                    Task.chat_id == chat_id,
+                    Task.status.in_([TaskStatus.PENDING, TaskStatus.RUNNING])
+                ).order_by(Task.created_at.desc()).limit(1)
+            ).scalar()
+
     def update_session_id(self, task_id: int, session_id: str):
         """Update Claude session ID for agent tasks."""
         with get_session() as session:
-            task = session.query(Task).get(task_id)
-            if task:
-                task.session_id = session_id
+            session.execute(update(Task).where(Task.id == task_id).values(session_id=session_id))
 
     def retry(self, task_id: int) -> bool:
         """Reset a failed task to pending.
@@ -188,15 +528,18 @@ class TaskManager:
             True if task was reset
         """
         with get_session() as session:
-            task = session.query(Task).get(task_id)
-            if task and task.status == TaskStatus.FAILED:
-                task.status = TaskStatus.PENDING
-                task.claimed_by = None
-                task.started_at = None
-                task.completed_at = None
-                task.error = None
-                return True
-            return False
+            return session.execute(
+                update(Task).where(
+                    Task.id == task_id, Task.status == TaskStatus.FAILED
+                ).values(
+                    status=TaskStatus.PENDING,
+                    claimed_by=None,
+                    claimed_until=None,
+                    started_at=None,
+                    completed_at=None,
+                    error=None,
+                ).returning(Task.id)
+            ).first() is not None
 
     def cancel(self, task_id: int) -> bool:
         """Cancel a pending task.
@@ -207,9 +550,18 @@ class TaskManager:
         Returns:
             True if task was cancelled
         """
+        # One statement: lock the task if still pending, detach its events
+        # (left over from a retried run) and delete it
+        pending = select(Task.id).where(
+            Task.id == task_id, Task.status == TaskStatus.PENDING
+        ).with_for_update().cte('pending')
+        detach = update(TaskEvent).where(
+            TaskEvent.task_id.in_(select(pending.c.id))
+        ).values(task_id=None).returning(TaskEvent.id).cte('detach')
+
         with get_session() as session:
-            task = session.query(Task).get(task_id)
-            if task and task.status == TaskStatus.PENDING:
-                session.delete(task)
-                return True
-            return False
+            return session.execute(
+                delete(Task).where(Task.id.in_(select(pending.c.id)))
+                .returning(Task.id).add_cte(detach),
+                execution_options={'synchronize_session': False},
+            ).first() is not None
@@ -2,21 +2,128 @@
 
 import asyncio
 import os
+import select
 import socket
 import time
 import signal
 import sys
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
-from .models import Task, TaskStatus
-from .task_manager import TaskManager
+from .models import TaskStatus, TASK_NOTIFY_CHANNEL
+from .task_manager import TaskManager, TaskView
 from .chat_manager import ChatManager
+from .database import get_db_engine, get_session
 from .secrets import secrets_service
 from .events import event_store
 from .executors.script import execute_script
 from .executors.agent import execute_agent, run_agent
 
 
+class TaskListener:
+    """LISTEN for pending-task notifications on a dedicated connection.
+
+    psycopg2 only. wait() returns False when notifications are unavailable
+    (other driver, connection lost) so the caller falls back to sleeping.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.supported = True
+        self._lock = threading.Lock()
+        # wait_async(): reader on the connection, event set on notification
+        self._loop = None
+        self._woken = None
+
+    def _connect(self) -> bool:
+        with self._lock:
+            return self._connect_locked()
+
+    def _connect_locked(self) -> bool:
+        if self.conn is not None:
+            return True
+        if not self.supported:
+            return False
+        try:
+            raw = get_db_engine().raw_connection()
+            # Keep it out of the pool: it stays in LISTEN mode for good
+            raw.detach()
+            conn = raw.dbapi_connection
+            if not hasattr(conn, 'notifies'):
+                raw.close()
+                self.supported = False
+                return False
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {TASK_NOTIFY_CHANNEL}")
+            self.conn = conn
+            return True
+        except Exception as e:
+            print(f"[listener] LISTEN unavailable, polling instead: {e}")
+            return False
+
+    def _drain(self) -> bool:
+        try:
+            self.conn.poll()
+            self.conn.notifies.clear()
+            return True
+        except Exception:
+            self.close()
+            return False
+
+    def wait(self, timeout: float) -> bool:
+        """Block until a notification arrives or `timeout` seconds pass."""
+        if not self._connect():
+            return False
+        try:
+            select.select([self.conn], [], [], timeout)
+        except Exception:
+            self.close()
+            return False
+        return self._drain()
+
+    async def wait_async(self, timeout: float) -> bool:
+        """wait() without blocking the event loop.
+
+        Several coroutines may wait at once: a notification wakes them all.
+        """
+        if not await asyncio.to_thread(self._connect):
+            return False
+        if self._woken is None:
+            self._loop = asyncio.get_running_loop()
+            self._woken = asyncio.Event()
+            self._loop.add_reader(self.conn.fileno(), self._on_readable)
+        try:
+            await asyncio.wait_for(self._woken.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.conn is not None
+
+    def _on_readable(self):
+        woken = self._woken
+        if self._drain():
+            self._woken = asyncio.Event()
+        woken.set()
+
+    def close(self):
+        if self._woken is not None:
+            try:
+                self._loop.remove_reader(self.conn.fileno())
+            except Exception:
+                pass
+            self._woken.set()
+            self._woken = None
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
 class Worker:
     """Task worker that polls for and executes tasks."""
 
@@ -24,16 +131,37 @@ class Worker:
         self,
         workspace: Optional[str] = None,
         worker_id: Optional[str] = None,
-        poll_interval: int = 5
+        poll_interval: int = 5,
+        min_interval: float = 0.1,
     ):
         self.workspace = workspace or os.getcwd()
         self.worker_id = worker_id or f"worker-{socket.gethostname()}"
+        # Idle polls back off from min_interval up to poll_interval
         self.poll_interval = poll_interval
+        self.min_interval = min(min_interval, poll_interval)
+        self._idle_interval = self.min_interval
         self.task_manager = TaskManager()
         self.chat_manager = ChatManager()
         self.running = False
-
-    def execute_task(self, task: Task) -> dict:
+        # Tasks claimed ahead of time (CLAIM_BATCH_SIZE > 1), oldest first.
+        # Those claims hold a CLAIM_LEASE: if this worker dies they are
+        # requeued by any worker once it expires.
+        self.batch_size = max(1, int(os.environ.get('CLAIM_BATCH_SIZE', '1')))
+        self.lease = float(os.environ.get('CLAIM_LEASE', '300')) if self.batch_size > 1 else None
+        self._claimed: deque[TaskView] = deque()
+        self._next_requeue = 0.0
+        # CLAIM_SHARDS > 1: claim from one slice of the queue first (by
+        # CLAIM_SHARD or a hash of the worker ID); FIFO only within a shard
+        shards = int(os.environ.get('CLAIM_SHARDS', '1'))
+        self.shard = None
+        if shards > 1:
+            index = os.environ.get('CLAIM_SHARD')
+            index = int(index) if index else zlib.crc32(self.worker_id.encode()) % shards
+            self.shard = (index % shards, shards)
+        # Wake on NOTIFY when idle instead of polling (TASK_NOTIFY=0 to disable)
+        self.listener = TaskListener() if os.environ.get('TASK_NOTIFY', '1') != '0' else None
+
+    def execute_task(self, task: TaskView) -> dict:
         """Execute a single task."""
         workspace = task.workspace or self.workspace
 
@@ -64,27 +192,30 @@ class Worker:
             if task.chat_id:
                 return self._execute_chat_agent(task, secrets)
 
-            # Legacy standalone agent
-            result = run_agent(task, secrets)
-            if result.get('session_id'):
-                self.task_manager.update_session_id(task.id, result['session_id'])
-            return result
+            # Legacy standalone agent (session_id saved with the outcome)
+            return run_agent(task, secrets)
 
         else:
             return {'success': False, 'error': f"Unknown task type: {task.task_type}"}
 
-    def _execute_chat_agent(self, task: Task, secrets: Optional[dict] = None) -> dict:
+    def _execute_chat_agent(self, task: TaskView, secrets: Optional[dict] = None) -> dict:
         """Execute agent task with chat context."""
-        chat = self.chat_manager.get_chat(task.chat_id)
-        if not chat:
-            return {'success': False, 'error': f"Chat {task.chat_id} not found"}
+        with get_session() as session:
+            chat = self.chat_manager.get_chat(task.chat_id, session=session)
+            if not chat:
+                return {'success': False, 'error': f"Chat {task.chat_id} not found"}
 
-        history = self.chat_manager.get_history(task.chat_id)
+            # Prerendered context when the chat keeps one, else the messages
+            rendered_history = self.chat_manager.get_rendered_history(task.chat_id, session=session)
+            history = None
+            if rendered_history is None:
+                history = self.chat_manager.get_history(task.chat_id, session=session)
 
         result = run_agent(
             task,
             secrets=secrets,
             history=history,
+            rendered_history=rendered_history,
             system_prompt=chat['system_prompt'],
             allowed_tools=chat['allowed_tools'],
             max_turns=chat['max_turns'],
@@ -93,22 +224,16 @@ class Worker:
         )
 
         if result.get('success'):
-            # Save user message + assistant response
-            self.chat_manager.add_message(
-                chat_id=task.chat_id,
-                role='user',
-                content=task.prompt,
-            )
-            self.chat_manager.add_message(
-                chat_id=task.chat_id,
-                role='assistant',
-                content=result.get('output', ''),
-                tokens_input=result.get('input_tokens', 0),
-                tokens_output=result.get('output_tokens', 0),
-            )
-
-        # Cleanup event store
-        event_store.cleanup(task.id)
+            # Save user message + assistant response (one INSERT)
+            self.chat_manager.add_messages(task.chat_id, [
+                {'role': 'user', 'content': task.prompt},
+                {
+                    'role': 'assistant',
+                    'content': result.get('output', ''),
+                    'tokens_input': result.get('input_tokens', 0),
+                    'tokens_output': result.get('output_tokens', 0),
+                },
+            ])
 
         return result
 
@@ -118,29 +243,112 @@ class Worker:
         Returns:
             True if a task was processed
         """
-        task = self.task_manager.claim(self.worker_id)
-        if not task:
+        if not self._claimed:
+            self._claimed.extend(self.task_manager.claim_batch(
+                self.worker_id, self.batch_size, self.lease, self.shard,
+            ))
+        try:
+            # Another slot (WORKER_CONCURRENCY) may have taken the last one
+            task = self._claimed.popleft()
+        except IndexError:
+            self._requeue_expired()
             return False
+        if task.claimed_until is not None and not self.task_manager.start(task):
+            print(f"[{self.worker_id}] Task {task.id} lease expired, skipped")
+            return True
 
         print(f"[{self.worker_id}] Processing task {task.id} ({task.task_type})")
 
         try:
             result = self.execute_task(task)
-
-            if result.get('success'):
-                self.task_manager.complete(task.id, result)
-                print(f"[{self.worker_id}] Task {task.id} completed")
-            else:
-                error = result.get('error', 'Unknown error')
-                self.task_manager.fail(task.id, error)
-                print(f"[{self.worker_id}] Task {task.id} failed: {error[:100]}")
-
         except Exception as e:
-            self.task_manager.fail(task.id, str(e))
             print(f"[{self.worker_id}] Task {task.id} exception: {e}")
+            result = {'success': False, 'error': str(e)}
+
+        error = None if result.get('success') else result.get('error', 'Unknown error')
+        self._finish(task, result, error)
+        if error is None:
+            print(f"[{self.worker_id}] Task {task.id} completed")
+        else:
+            print(f"[{self.worker_id}] Task {task.id} failed: {error[:100]}")
 
+        # Free its events and end SSE streams, once the status is final
+        event_store.cleanup(task.id)
         return True
 
+    def _finish(self, task: TaskView, result: dict, error: Optional[str]):
+        """Record a task outcome, topping the local queue back up to
+        batch_size in the same statement once it is down to half.
+
+        A new agent session_id is written by that same UPDATE (and not at
+        all when unchanged) instead of in a transaction of its own. If the
+        claim side fails (retries exhausted, statement or lock timeout), it
+        rolls the outcome back with it: the outcome is then recorded alone.
+        """
+        session_id = result.get('session_id')
+        if session_id == task.session_id:
+            session_id = None
+        if self.running and len(self._claimed) <= self.batch_size // 2:
+            refill = self.batch_size - len(self._claimed)
+            try:
+                self._claimed.extend(self.task_manager.complete_and_claim_next(
+                    task.id, self.worker_id, refill, result=result, error=error,
+                    lease=self.lease, shard=self.shard, session_id=session_id,
+                ))
+                return
+            except Exception as e:
+                print(f"[{self.worker_id}] Task {task.id}: claiming next with the outcome failed ({e}), recording it alone")
+        if error is None:
+            self.task_manager.complete(task.id, result, session_id=session_id)
+        else:
+            self.task_manager.fail(task.id, error, session_id=session_id)
+
+    def _requeue_expired(self):
+        """Requeue expired leases (of crashed workers), at most every 60s."""
+        if time.monotonic() < self._next_requeue:
+            return
+        self._next_requeue = time.monotonic() + 60
+        requeued = self.task_manager.requeue_expired()
+        if requeued:
+            print(f"[{self.worker_id}] Requeued {requeued} task(s) with an expired claim lease")
+
+    def idle_delay(self, processed: bool) -> float:
+        """Seconds to wait before the next poll.
+
+        No wait right after a task; consecutive empty polls wait 1.5x
+        longer each time, capped at poll_interval.
+        """
+        if processed:
+            self._idle_interval = self.min_interval
+            return 0
+        delay = self._idle_interval
+        self._idle_interval = min(self.poll_interval, delay * 1.5)
+        return delay
+
+    def wait(self, processed: bool):
+        """Wait before the next poll.
+
+        When idle and listening, blocks until a task is queued (at most
+        poll_interval, to catch missed notifications); otherwise sleeps
+        idle_delay().
+        """
+        delay = self.idle_delay(processed)
+        if delay and not (self.listener and self.listener.wait(self.poll_interval)):
+            time.sleep(delay)
+
+    async def wait_async(self, processed: bool):
+        """wait() for the async poll loop."""
+        delay = self.idle_delay(processed)
+        if delay and not (self.listener and await self.listener.wait_async(self.poll_interval)):
+            await asyncio.sleep(delay)
+
+    def release_claimed(self):
+        """Return tasks claimed ahead but not started to the queue."""
+        released = self.task_manager.release([t.id for t in self._claimed], self.worker_id)
+        self._claimed.clear()
+        if released:
+            print(f"[{self.worker_id}] Released {released} unstarted task(s)")
+
     def run(self):
         """Start the worker polling loop (blocking, for CLI use)."""
         self.running = True
@@ -154,44 +362,68 @@ class Worker:
 
         print(f"[{self.worker_id}] Starting worker")
         print(f"[{self.worker_id}] Workspace: {self.workspace}")
-        print(f"[{self.worker_id}] Poll interval: {self.poll_interval}s")
+        print(f"[{self.worker_id}] Poll interval: {self.min_interval}-{self.poll_interval}s")
 
         while self.running:
             try:
-                if not self.process_one():
-                    time.sleep(self.poll_interval)
+                self.wait(self.process_one())
             except KeyboardInterrupt:
                 break
             except Exception as e:
                 print(f"[{self.worker_id}] Error: {e}")
                 time.sleep(self.poll_interval)
 
+        self.release_claimed()
+        if self.listener:
+            self.listener.close()
         print(f"[{self.worker_id}] Worker stopped")
 
 
 async def async_poll_loop(
     workspace: Optional[str] = None,
     worker_id: Optional[str] = None,
-    poll_interval: int = 5
+    poll_interval: int = 5,
+    concurrency: Optional[int] = None,
 ):
-    """Async polling loop for coexistence with FastAPI event loop."""
+    """Async polling loop for coexistence with FastAPI event loop.
+
+    Runs up to `concurrency` tasks at once (default WORKER_CONCURRENCY or
+    1), each slot on a thread of a dedicated pool, not the default
+    executor that also serves FastAPI's sync endpoints.
+    """
+    if concurrency is None:
+        concurrency = int(os.environ.get('WORKER_CONCURRENCY', '1'))
+    concurrency = max(1, concurrency)
     worker = Worker(
         workspace=workspace,
         worker_id=worker_id,
         poll_interval=poll_interval
     )
     worker.running = True
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="otomata-poll")
 
-    print(f"[{worker.worker_id}] Starting async poll loop (interval: {poll_interval}s)")
+    print(f"[{worker.worker_id}] Starting async poll loop (interval: {poll_interval}s, concurrency: {concurrency})")
 
-    while worker.running:
-        try:
-            processed = await asyncio.to_thread(worker.process_one)
-            if not processed:
+    async def slot():
+        while worker.running:
+            try:
+                processed = await loop.run_in_executor(executor, worker.process_one)
+                await worker.wait_async(processed)
+            except Exception as e:
+                print(f"[{worker.worker_id}] Poll error: {e}")
                 await asyncio.sleep(poll_interval)
-        except Exception as e:
-            print(f"[{worker.worker_id}] Poll error: {e}")
-            await asyncio.sleep(poll_interval)
+
+    try:
+        await asyncio.gather(*(slot() for _ in range(concurrency)))
+    finally:
+        # Let tasks still running finish (without claiming more), then
+        # release the ones claimed ahead
+        worker.running = False
+        await asyncio.to_thread(executor.shutdown)
+        await asyncio.to_thread(worker.release_claimed)
+        if worker.listener:
+            worker.listener.close()
 
 
 def run_worker(